@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Admission control for the upload endpoints
+
+Each request reserves an estimate of the memory it will hold at its peak and
+a concurrency slot before doing any heavy work. When either the memory budget
+or the concurrency limit is exhausted, requests wait in a bounded queue for a
+short time and are then rejected with a retry hint, so a burst of large
+uploads degrades into 503s instead of an out-of-memory kill.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+MB = 1024 * 1024
+
+class Rejected(Exception):
+    """Raised when a request cannot be admitted"""
+    
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(self, max_concurrent, memory_budget, max_queue, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.memory_budget = memory_budget
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.reserved = 0
+        self.waiting = 0
+        self._avg_hold = 1.0
+        self._cond = threading.Condition()
+    
+    def _fits(self, cost):
+        return self.in_flight < self.max_concurrent and self.reserved + cost <= self.memory_budget
+    
+    def retry_after(self):
+        """Seconds a client should wait, from the average time a slot is held"""
+        backlog = (self.waiting + 1) / float(max(1, self.max_concurrent))
+        return max(1, int(math.ceil(self._avg_hold * backlog)))
+    
+    def acquire(self, cost):
+        if cost > self.memory_budget:
+            REJECTED.inc(reason='too_large')
+            raise Rejected(f"Request needs about {cost // MB} MB, more than the "
+                           f"{self.memory_budget // MB} MB budget", status=413)
+        
+        with self._cond:
+            if not self._fits(cost):
+                if self.waiting >= self.max_queue:
+                    REJECTED.inc(reason='queue_full')
+                    raise Rejected("Server busy, retry later", retry_after=self.retry_after())
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while not self._fits(cost):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            REJECTED.inc(reason='timeout')
+                            raise Rejected("Server busy, retry later", retry_after=self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.reserved += cost
+    
+    def release(self, cost, held_seconds):
+        with self._cond:
+            self.in_flight -= 1
+            self.reserved -= cost
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held_seconds
+            self._cond.notify_all()
+    
+    @contextmanager
+    def admit(self, cost):
+        """Hold a slot and ``cost`` bytes of the budget for the ``with`` block"""
+        self.acquire(cost)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(cost, time.monotonic() - start)
+
+def image_cost(upload_bytes, width, height):
+    """Peak bytes for one image request.
+    
+    The upload bytes, the decoded frame, the downscaled inference copy, the
+    JPEG result and its base64/JSON forms are alive at once.
+    """
+    decoded = width * height * 3
+    return upload_bytes + decoded + upload_bytes * 3 + 4 * MB
+
+def video_cost(width, height, buffered_frames=4):
+    """Peak bytes for a video job: a handful of frames plus codec state"""
+    return width * height * 3 * buffered_frames + 32 * MB
+
+REJECTED = metrics.counter('vehicle_admission_rejected',
+                           'Requests rejected by admission control',
+                           ['reason'])
+
+controller = AdmissionController(
+    max_concurrent=int(os.environ.get('MAX_CONCURRENT_REQUESTS', os.cpu_count() or 1)),
+    memory_budget=int(float(os.environ.get('MEMORY_BUDGET_MB', '1024')) * MB),
+    max_queue=int(os.environ.get('ADMISSION_MAX_QUEUE', '16')),
+    queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '10'))
+)
+
+metrics.gauge('vehicle_admission_in_flight', 'Requests holding an admission slot',
+              function=lambda: controller.in_flight)
+metrics.gauge('vehicle_admission_waiting', 'Requests queued for admission',
+              function=lambda: controller.waiting)
+metrics.gauge('vehicle_admission_reserved_bytes', 'Memory reserved by admitted requests',
+              function=lambda: controller.reserved)
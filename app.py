@@ -1,22 +1,46 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, g, Response, stream_with_context
 from flask_cors import CORS
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import base64
-import io
-from PIL import Image
+import hashlib
 import json
+import math
 import os
+import tarfile
 import time
 import threading
+import zipfile
+import zlib
 from collections import defaultdict
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+import admission
+import detection_store
+import detection_batch
+import imaging
+import metrics
+import model_pool
+import output_store
+import profiling
+import spool
+import tuning
 
 app = Flask(__name__)
+app.request_class = spool.SpoolingRequest
 CORS(app)
 
-# Global variables for detection statistics
+# Reject oversized request bodies before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_UPLOAD_MB', '1024')) * admission.MB)
+
+# Processed videos are stored here by input hash and served by /download
+OUTPUT_DIR = os.environ.get('OUTPUT_DIR', 'outputs')
+OUTPUT_QUOTA_MB = float(os.environ.get('OUTPUT_QUOTA_MB', '2048'))
+
+# Global variables for detection statistics, updated by concurrent
+# inference threads under stats_lock
+stats_lock = threading.Lock()
 detection_stats = {
     'total_detections': 0,
     'vehicle_counts': defaultdict(int),
@@ -24,57 +48,182 @@ detection_stats = {
     'last_detection_time': None
 }
 
-# Initialize YOLO model
-model = None
+# Output store and per-minute/hour/day detection history, opened by setup()
+outputs = None
+history_store = None
+
+# Pool of YOLO model instances, built by initialize_model()
+models = None
+
+# Token required by the /admin and /profiles endpoints; without one they are
+# only reachable from localhost
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Per-machine settings written by `python test_installation.py --tune`
+TUNED_CONFIG = tuning.load_tuned_config()
+PREDICT_KWARGS = tuning.predict_kwargs(TUNED_CONFIG)
+
+# Model file to load; 'stub' swaps in the deterministic detector from
+# stub_detector.py so load tests don't depend on the model
+MODEL_PATH = os.environ.get('VEHICLE_MODEL', TUNED_CONFIG['model'])  # nano by default for faster inference
+STUB_LATENCY_MS = float(os.environ.get('STUB_LATENCY_MS', '0'))
+
+# Independent model instances, so request threads can run inference at the
+# same time; the tuned thread budget (or all cores) is split between them.
+# Every instance is a full model loaded at startup, so only one by default.
+MODEL_POOL_SIZE = int(os.environ.get('MODEL_POOL_SIZE', '1'))
+MODEL_THREADS = max(1, (TUNED_CONFIG['threads'] or os.cpu_count() or 1) // MODEL_POOL_SIZE)
+# Seconds a request waits for a free instance before it is turned away
+MODEL_CHECKOUT_TIMEOUT = float(os.environ.get('MODEL_CHECKOUT_TIMEOUT', '30'))
+
+# Frames larger than this (longest side, pixels) are shrunk before inference;
+# YOLO letterboxes to its input size anyway. 0 disables.
+MAX_INFERENCE_SIDE = int(os.environ.get('MAX_INFERENCE_SIDE', PREDICT_KWARGS.get('imgsz', 640)))
+
+# Per-thread resize buffer, reused across the frames of a video job
+_inference_buffers = threading.local()
+
+# Batch uploads: images per model call (the tuned batch size by default),
+# the most images one request may contain, and threads decoding them
+BATCH_INFERENCE_SIZE = int(os.environ.get('BATCH_INFERENCE_SIZE', TUNED_CONFIG['batch_size'] or 1))
+MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', '500'))
+decode_pool = ThreadPoolExecutor(int(os.environ.get('DECODE_WORKERS', os.cpu_count() or 1)),
+                                 thread_name_prefix='decode')
+
+def output_settings():
+    """Everything besides the input that changes an annotated video"""
+    return {'model': MODEL_PATH, 'classes': VEHICLE_CLASSES, 'confidence': CONFIDENCE_THRESHOLD,
+            'predict': PREDICT_KWARGS, 'max_side': MAX_INFERENCE_SIDE}
+
+def setup():
+    """Open the output and history stores and clear stale spool files
+    
+    Called once when a server starts rather than at import, so tools that
+    only import helpers from here leave no files or writer threads behind.
+    """
+    global outputs, history_store
+    if outputs is not None:
+        return
+    spool.remove_stale()
+    outputs = output_store.OutputStore(OUTPUT_DIR, int(OUTPUT_QUOTA_MB * admission.MB))
+    # Rollups persist across restarts; the in-memory totals resume from them
+    history_store = detection_store.DetectionStore()
+    saved_counts, total = history_store.totals()
+    with stats_lock:
+        detection_stats['total_detections'] = total
+        detection_stats['vehicle_counts'].update(saved_counts)
+
+metrics.gauge('vehicle_output_store_bytes', 'Bytes of annotated videos kept in the output store',
+              function=lambda: outputs.usage()['bytes'] if outputs else None)
 
 def initialize_model():
-    global model
+    global models
     try:
-        model = YOLO('yolov8n.pt')  # Using nano version for faster inference
-        print("YOLO model loaded successfully!")
+        tuning.apply_threads(TUNED_CONFIG['threads'])
+        if MODEL_PATH == 'stub':
+            from stub_detector import StubYOLO
+            factory = lambda: StubYOLO(latency_ms=STUB_LATENCY_MS)
+        else:
+            # Imported here so the server starts (and answers /stats) while
+            # the ultralytics/torch stack is still loading
+            from ultralytics import YOLO
+            factory = lambda: YOLO(MODEL_PATH)
+        models = model_pool.ModelPool(factory, MODEL_POOL_SIZE, MODEL_THREADS)
+        print(f"YOLO model loaded successfully! ({MODEL_POOL_SIZE} instance(s), {MODEL_THREADS} thread(s) each)")
     except Exception as e:
         print(f"Error loading YOLO model: {e}")
 
-def detect_vehicles(image):
-    """Detect vehicles in the given image using YOLO v8"""
+metrics.gauge('vehicle_model_pool_size', 'Model instances in the pool',
+              function=lambda: models.size if models else None)
+metrics.gauge('vehicle_model_pool_in_use', 'Model instances currently running inference',
+              function=lambda: models.in_use if models else None)
+metrics.gauge('vehicle_model_pool_utilization', 'Share of pool capacity used over the last minute',
+              function=lambda: models.utilization() if models else None)
+
+# Vehicle classes in COCO dataset (YOLO v8 uses COCO classes)
+VEHICLE_CLASSES = list(detection_batch.VEHICLE_CLASSES)  # car, motorcycle, bus, truck
+VEHICLE_NAMES = list(detection_batch.VEHICLE_NAMES)
+CONFIDENCE_THRESHOLD = detection_batch.CONFIDENCE_THRESHOLD
+
+def extract_vehicle_detections(results, scale=1.0):
+    """Filter raw YOLO results down to vehicle detections
+    
+    ``scale`` is the factor the image was resized by before inference; boxes
+    are mapped back to the original image coordinates. Returns a
+    DetectionBatch and a {class name: count} dict.
+    """
+    detections = detection_batch.DetectionBatch.from_results(results, scale, CONFIDENCE_THRESHOLD)
+    return detections, detections.count_by_name()
+
+def detect_vehicles(image, source='image', scale=1.0):
+    """Detect vehicles in the given image using YOLO v8
+    
+    ``scale`` is the size the image was decoded at relative to the original
+    upload (see imaging.decode_image); boxes are in original coordinates.
+    """
     global detection_stats
     
-    if model is None:
+    if models is None:
         return None, "Model not loaded"
     
     try:
+        # Shrink oversized frames first; boxes are mapped back below
+        buffer = getattr(_inference_buffers, 'resized', None)
+        inference_image, resize_scale = imaging.downscale_for_inference(image, MAX_INFERENCE_SIDE, buffer)
+        if resize_scale != 1.0:
+            _inference_buffers.resized = inference_image
+        
         # Run detection
-        results = model(image)
+        with metrics.MODEL_QUEUE_DEPTH.track_inprogress():
+            with models.checkout(MODEL_CHECKOUT_TIMEOUT) as model, profiling.stage('inference'):
+                results = model(inference_image, **PREDICT_KWARGS)
         
-        # Vehicle classes in COCO dataset (YOLO v8 uses COCO classes)
-        vehicle_classes = [2, 3, 5, 7]  # car, motorcycle, bus, truck
-        vehicle_names = ['car', 'motorcycle', 'bus', 'truck']
+        with profiling.stage('postprocess'):
+            detections, vehicle_count = extract_vehicle_detections(results, scale * resize_scale)
+        del results
         
-        detections = []
-        vehicle_count = defaultdict(int)
+        record_detections(detections, vehicle_count, source)
+        return detections, None
+    
+    except model_pool.PoolTimeout:
+        raise
+    except Exception as e:
+        return None, str(e)
+
+def detect_vehicles_batch(images, source='image', scales=None):
+    """Detect vehicles in several images with one model call; returns (list of DetectionBatch, error)
+    
+    ``scales`` gives each image's decode scale, as for detect_vehicles.
+    """
+    if models is None:
+        return None, "Model not loaded"
+    
+    try:
+        scaled = []
+        for image, scale in zip(images, scales or [1.0] * len(images)):
+            resized, resize_scale = imaging.downscale_for_inference(image, MAX_INFERENCE_SIDE)
+            scaled.append((resized, scale * resize_scale))
+        with metrics.MODEL_QUEUE_DEPTH.track_inprogress():
+            with models.checkout(MODEL_CHECKOUT_TIMEOUT) as model, profiling.stage('inference'):
+                results = model([image for image, _ in scaled], **PREDICT_KWARGS)
         
-        for result in results:
-            boxes = result.boxes
-            if boxes is not None:
-                for box in boxes:
-                    # Get class and confidence
-                    class_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    
-                    # Check if it's a vehicle
-                    if class_id in vehicle_classes and confidence > 0.5:
-                        # Get bounding box coordinates
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        
-                        vehicle_name = vehicle_names[vehicle_classes.index(class_id)]
-                        vehicle_count[vehicle_name] += 1
-                        
-                        detections.append({
-                            'class': vehicle_name,
-                            'confidence': confidence,
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)]
-                        })
+        with profiling.stage('postprocess'):
+            batches = [detection_batch.DetectionBatch.from_result(result, scale, CONFIDENCE_THRESHOLD)
+                       for result, (_, scale) in zip(results, scaled)]
+        del results, scaled
         
+        for detections in batches:
+            record_detections(detections, detections.count_by_name(), source)
+        return batches, None
+    
+    except model_pool.PoolTimeout:
+        raise
+    except Exception as e:
+        return None, str(e)
+
+def record_detections(detections, vehicle_count, source):
+    """Add one image's detections to the dashboard statistics and the history store"""
+    with stats_lock:
         # Update statistics
         detection_stats['total_detections'] += len(detections)
         detection_stats['last_detection_time'] = time.time()
@@ -92,19 +241,13 @@ def detect_vehicles(image):
         # Keep only last 100 detections in history
         if len(detection_stats['detection_history']) > 100:
             detection_stats['detection_history'] = detection_stats['detection_history'][-100:]
-        
-        return detections, None
-        
-    except Exception as e:
-        return None, str(e)
+    
+    # Persisted by the background writer, off the request path
+    history_store.record(vehicle_count, source)
 
 def draw_detections(image, detections):
     """Draw bounding boxes and labels on the image"""
-    for detection in detections:
-        x1, y1, x2, y2 = detection['bbox']
-        class_name = detection['class']
-        confidence = detection['confidence']
-        
+    for class_name, confidence, (x1, y1, x2, y2) in detections.rows():
         # Draw bounding box
         cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
         
@@ -116,10 +259,57 @@ def draw_detections(image, detections):
     
     return image
 
+def admin_allowed():
+    if ADMIN_TOKEN:
+        return request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.before_request
+def start_profiling():
+    """Profile the request if it asks for it (X-Profile) or is sampled"""
+    if profiling.should_profile(request.headers):
+        g.profile = profiling.start(f"{request.method} {request.path}")
+
+@app.after_request
+def finish_profiling(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.id
+        if response.is_streamed:
+            # A streamed body is generated after this; profile it too
+            response.call_on_close(partial(profiling.finish, profile, response.status_code))
+        else:
+            profiling.finish(profile, response.status_code)
+    return response
+
+@app.teardown_request
+def discard_profiling(error=None):
+    # Unhandled errors skip after_request; still detach from the sampler
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiling.finish(profile, 500)
+
+def rejected_response(error):
+    """Response for a request turned away by admission control"""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status
+
+@app.after_request
+def count_request(response):
+    """Count every request by type (image/video for uploads) and status"""
+    request_type = g.get('request_type', request.endpoint or 'unknown')
+    metrics.REQUESTS.inc(type=request_type, status=response.status_code)
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'bmp', 'gif']
+VIDEO_EXTENSIONS = ['mp4', 'avi', 'mov', 'mkv', 'wmv']
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -133,157 +323,737 @@ def upload_file():
         # Check file type
         file_extension = file.filename.lower().split('.')[-1]
         
-        if file_extension in ['jpg', 'jpeg', 'png', 'bmp', 'gif']:
+        if file_extension in IMAGE_EXTENSIONS:
             # Process as image
-            return process_image(file)
-        elif file_extension in ['mp4', 'avi', 'mov', 'mkv', 'wmv']:
+            g.request_type = 'image'
+            annotate = form_flag(request.values, 'annotate', default=True)
+            with admission.controller.admit(image_upload_cost(file.stream, request.content_length,
+                                                              decode_min_side(annotate))):
+                return process_image(file, annotate)
+        elif file_extension in VIDEO_EXTENSIONS:
             # Process as video
+            g.request_type = 'video'
             return process_video(file)
         else:
             return jsonify({'error': 'Unsupported file type. Please upload an image or video file.'}), 400
+    
+    except admission.Rejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Detect vehicles in many images: several 'files' parts and/or zip/tar archives"""
+    g.request_type = 'batch'
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    try:
+        try:
+            annotate, stream = batch_request_options(request.values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # A streamed batch reads its uploads after the view has returned
+        streams = [spool.detach_stream(f) if stream else f.stream for f in uploads]
+        try:
+            sources = batch_sources([(f.filename, s) for f, s in zip(uploads, streams)])
+        except ValueError as e:
+            if stream:
+                for s in streams:
+                    s.close()
+            return jsonify({'error': str(e)}), 400
         
+        # The first batch runs before the response starts, so a busy server
+        # still answers 503
+        if stream:
+            lines = started(batch_lines(sources, annotate, streams))
+            return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+        return jsonify(batch_result(started(batch_job(sources, annotate))))
+    
+    except admission.Rejected as e:
+        return rejected_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def process_image(file):
+def image_upload_cost(stream, upload_bytes=None, min_side=None):
+    """Estimate peak memory for an image upload from its header alone"""
+    header = stream.read(65536)
+    stream.seek(0)
+    return image_data_cost(header, upload_bytes or len(header), min_side)
+
+def image_data_cost(header, upload_bytes, min_side=None):
+    """Estimate peak memory for one image from its first bytes and encoded size
+    
+    ``min_side`` is passed on to imaging.decode_image; a reduced decode
+    reserves only the smaller frame.
+    """
+    size = imaging.decoded_size(header, min_side)
+    if size is None:
+        # Unknown format: assume a typical 10:1 compression ratio
+        return admission.image_cost(upload_bytes, upload_bytes * 10 // 3, 1)
+    return admission.image_cost(upload_bytes, *size)
+
+def process_image(file, annotate=True):
     """Process uploaded image file"""
+    body, status = analyze_image(file.read(), annotate)
+    return Response(detection_batch.dumps(body), status, mimetype='application/json')
+
+def decode_min_side(annotate):
+    """Longer side an upload must be decoded at: full size when an annotated image is returned"""
+    return None if annotate else MAX_INFERENCE_SIDE
+
+def analyze_image(image_data, annotate=True):
+    """Detect vehicles in encoded image bytes; returns (response body, status)
+    
+    Without ``annotate`` no annotated image is returned, so a large JPEG is
+    decoded at reduced size (just big enough for the model) instead. The
+    body's detections are a DetectionBatch: encode it with
+    detection_batch.dumps.
+    """
     try:
         # Read image
-        image_data = file.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with profiling.stage('decode'):
+            image, scale = imaging.decode_image(image_data, decode_min_side(annotate))
+        # The raw upload is no longer needed once decoded
+        del image_data
         
         if image is None:
-            return jsonify({'error': 'Invalid image file'}), 400
+            return {'error': 'Invalid image file'}, 400
         
         # Detect vehicles
-        detections, error = detect_vehicles(image)
+        detections, error = detect_vehicles(image, scale=scale)
         
         if error:
-            return jsonify({'error': error}), 500
+            return {'error': error}, 500
+        
+        stats = {
+            'total_vehicles': len(detections),
+            'vehicle_breakdown': detections.count_by_name()
+        }
+        if not annotate:
+            return {'success': True, 'type': 'image', 'detections': detections, 'stats': stats}, 200
         
-        # Draw detections
-        result_image = draw_detections(image.copy(), detections)
+        # Draw detections straight onto the decoded image; inference has
+        # already run, so no pristine copy is needed
+        with profiling.stage('draw'):
+            result_image = draw_detections(image, detections)
         
         # Convert result to base64
-        _, buffer = cv2.imencode('.jpg', result_image)
-        result_base64 = base64.b64encode(buffer).decode('utf-8')
+        with profiling.stage('encode'):
+            _, buffer = cv2.imencode('.jpg', result_image)
+        del image, result_image
+        with profiling.stage('base64'):
+            result_base64 = base64.b64encode(buffer).decode('utf-8')
+        del buffer
         
-        return jsonify({
+        return {
             'success': True,
             'type': 'image',
             'detections': detections,
             'image': result_base64,
-            'stats': {
-                'total_vehicles': len(detections),
-                'vehicle_breakdown': {det['class']: sum(1 for d in detections if d['class'] == det['class']) for det in detections}
-            }
-        })
+            'stats': stats
+        }, 200
+    
+    except admission.Rejected:
+        raise
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+# What reading a corrupt, truncated or encrypted archive member raises
+MEMBER_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, OSError,
+                 NotImplementedError, RuntimeError)
+
+def form_flag(values, name, default=False):
+    """Boolean option from form/query values ('1', 'true', 'yes' or '0', 'false', 'no')"""
+    value = values.get(name, '').strip().lower()
+    if not value:
+        return default
+    return value in ('1', 'true', 'yes')
+
+def batch_request_options(values):
+    """(annotate, stream) from a batch upload's form/query values
+    
+    Annotated images are only returned streamed: a single JSON response
+    would hold every base64 image in memory, outside the admission budget.
+    """
+    annotate = form_flag(values, 'annotate')
+    stream = form_flag(values, 'stream')
+    if annotate and not stream:
+        raise ValueError("annotate=1 requires stream=1")
+    return annotate, stream
+
+def batch_sources(files):
+    """(name, size, read) for every image in the uploaded (filename, file object) pairs
+    
+    Zip and tar archives are expanded. ``size`` is the encoded size (declared
+    by the archive for members) and ``read(limit=-1)`` returns up to
+    ``limit`` of the image's bytes, so the cost of a batch can be estimated
+    from headers before anything is decoded. Zip members are decompressed
+    when read; tar members are copied out here, in archive order.
+    """
+    sources = []
+    for filename, stream in files:
+        lower = filename.lower()
+        if lower.endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(stream)
+            except zipfile.BadZipFile:
+                raise ValueError(f"{filename} is not a valid zip archive")
+            for info in archive.infolist():
+                if not info.is_dir() and is_batch_image(filename, info.filename, info.file_size, len(sources)):
+                    sources.append((f"{filename}/{info.filename}", info.file_size,
+                                    partial(read_member, archive.open, info)))
+        elif lower.endswith(ARCHIVE_SUFFIXES):
+            sources.extend(tar_sources(filename, stream, len(sources)))
+        elif lower.split('.')[-1] in IMAGE_EXTENSIONS:
+            size = stream.seek(0, os.SEEK_END)
+            sources.append((filename, size, partial(read_upload, stream)))
+        else:
+            raise ValueError(f"Unsupported file type in batch: {filename}")
+    
+    if not sources:
+        raise ValueError("No images found in upload")
+    if len(sources) > MAX_BATCH_IMAGES:
+        raise ValueError(f"At most {MAX_BATCH_IMAGES} images per batch, got {len(sources)}")
+    return sources
+
+def tar_sources(filename, stream, count):
+    """Batch sources for the images in a tar archive, read in one forward pass
+    
+    A compressed tar can't seek: every backward seek decompresses it again
+    from the start. Each image member is therefore copied to a spool buffer
+    as the archive is read, and later reads come from that buffer. Damage
+    part way through ends the archive with a source that fails to read.
+    """
+    try:
+        archive = tarfile.open(fileobj=stream, mode='r|*')
+    except tarfile.TarError:
+        raise ValueError(f"{filename} is not a valid tar archive")
+    members = []
+    name = filename
+    with archive:
+        try:
+            for info in archive:
+                if not info.isfile() or not is_batch_image(filename, info.name, info.size, count + len(members)):
+                    continue
+                name = f"{filename}/{info.name}"
+                with archive.extractfile(info) as member:
+                    buffer = spool.buffer_stream(member)
+                members.append((name, info.size, partial(read_upload, buffer)))
+                name = filename
+        except MEMBER_ERRORS as e:
+            members.append((name, 0, partial(failed_read, e)))
+    return members
+
+def is_batch_image(filename, name, size, count):
+    """Whether an archive member is an image to add to ``count`` sources so far; raises ValueError past the limits"""
+    if name.lower().split('.')[-1] not in IMAGE_EXTENSIONS:
+        return False
+    # Declared sizes are checked before anything is decompressed
+    if size > admission.controller.memory_budget:
+        raise ValueError(f"{filename}/{name} is too large")
+    if count >= MAX_BATCH_IMAGES:
+        raise ValueError(f"At most {MAX_BATCH_IMAGES} images per batch")
+    return True
+
+def read_upload(stream, limit=-1):
+    stream.seek(0)
+    return stream.read(limit)
+
+def read_member(open_member, info, limit=-1):
+    with open_member(info) as member:
+        return member.read(limit)
+
+def failed_read(error, limit=-1):
+    raise error
+
+def batch_job(sources, annotate=False):
+    """Detect vehicles in batch sources, yielding a record per image and a summary
+    
+    Images are decoded BATCH_INFERENCE_SIZE at a time in parallel on
+    decode_pool (at reduced size unless annotating), and each group goes
+    through the model in one call, holding an admission slot only while it
+    is processed. A rejection of the first group is raised; later groups
+    report it per image.
+    """
+    start = time.perf_counter()
+    class_totals = np.zeros(len(VEHICLE_NAMES), dtype=np.int64)
+    processed = failed = 0
+    for offset in range(0, len(sources), BATCH_INFERENCE_SIZE):
+        chunk = sources[offset:offset + BATCH_INFERENCE_SIZE]
+        try:
+            records = analyze_batch(chunk, offset, annotate)
+        except admission.Rejected as e:
+            if offset == 0:
+                raise
+            records = [{'type': 'image', 'index': offset + i, 'name': name, 'error': str(e)}
+                       for i, (name, _, _) in enumerate(chunk)]
+        for record in records:
+            if 'error' in record:
+                failed += 1
+            else:
+                processed += 1
+                class_totals += record.pop('counts')
+            yield record
+    
+    yield {'type': 'summary', 'images': processed, 'failed': failed,
+           'total_vehicles': int(class_totals.sum()),
+           'vehicle_breakdown': {name: int(n) for name, n in zip(VEHICLE_NAMES, class_totals) if n},
+           'seconds': round(time.perf_counter() - start, 3)}
+
+def analyze_batch(chunk, offset, annotate):
+    """Records for one inference batch of (name, size, read) sources"""
+    records = [{'type': 'image', 'index': offset + i, 'name': name} for i, (name, _, _) in enumerate(chunk)]
+    # The reservation comes from each image's header and declared size, so
+    # nothing is decompressed in full before it is admitted
+    min_side = decode_min_side(annotate)
+    cost = 0
+    for record, (_, size, read) in zip(records, chunk):
+        header = read_source(record, read, 65536)
+        if header is not None:
+            cost += image_data_cost(header, size, min_side)
+    with admission.controller.admit(cost):
+        # Archive members are read one after another; only decoding is parallel
+        datas = [read_source(record, read) if 'error' not in record else None
+                 for record, (_, _, read) in zip(records, chunk)]
+        readable = [i for i, data in enumerate(datas) if data is not None]
+        with profiling.stage('decode'):
+            decoded_images = [None] * len(chunk)
+            for i, result in zip(readable, decode_pool.map(partial(imaging.decode_image, min_side=min_side),
+                                                           [datas[i] for i in readable])):
+                decoded_images[i] = result
+        del datas
+        images = [result[0] if result is not None else None for result in decoded_images]
+        
+        decoded = [i for i, image in enumerate(images) if image is not None]
+        for i in readable:
+            if images[i] is None:
+                records[i]['error'] = 'Invalid image file'
+        if not decoded:
+            return records
         
+        batches, error = detect_vehicles_batch([images[i] for i in decoded],
+                                               scales=[decoded_images[i][1] for i in decoded])
+        del decoded_images
+        for n, i in enumerate(decoded):
+            record = records[i]
+            if error:
+                record['error'] = error
+                continue
+            detections = batches[n]
+            record.update(detections=detections, counts=detections.counts(),
+                          stats={'total_vehicles': len(detections),
+                                 'vehicle_breakdown': detections.count_by_name()})
+            if annotate:
+                with profiling.stage('draw'):
+                    image = draw_detections(images[i], detections)
+                with profiling.stage('encode'):
+                    _, buffer = cv2.imencode('.jpg', image)
+                record['image'] = base64.b64encode(buffer).decode('utf-8')
+            images[i] = None
+        return records
+
+def read_source(record, read, limit=-1):
+    """``read(limit)`` for a batch source, or None with the error set on its record"""
+    try:
+        return read(limit)
+    except MEMBER_ERRORS as e:
+        record['error'] = f"Unreadable archive member: {e}"
+        return None
+
+def batch_lines(sources, annotate, streams=()):
+    """NDJSON lines for a streamed batch; closes ``streams`` (the uploads) when done"""
+    try:
+        for record in batch_job(sources, annotate):
+            yield detection_batch.dumps(record) + '\n'
+    except admission.Rejected:
+        # Only the first group raises this, before the response has started
+        raise
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+    finally:
+        for stream in streams:
+            stream.close()
+
+def batch_result(records):
+    """Non-streamed response body for a batch upload"""
+    results = []
+    for record in records:
+        if record.pop('type') == 'summary':
+            return {'success': True, 'type': 'batch', 'results': results, 'stats': record}
+        if 'detections' in record:
+            record['detections'] = record['detections'].to_dicts()
+        results.append(record)
+
+def started(generator):
+    """Run a generator up to its first item now, so errors raise here; returns an equivalent generator"""
+    first = next(generator)
+    
+    def resume():
+        yield first
+        yield from generator
+    return resume()
 
 def process_video(file):
     """Process uploaded video file"""
     try:
-        # Save uploaded video temporarily
-        video_filename = f"temp_video_{int(time.time())}.{file.filename.split('.')[-1]}"
-        video_path = os.path.join(os.getcwd(), video_filename)
-        file.save(video_path)
+        try:
+            options, stream = video_request_options(request.values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Process video and create output
-        output_filename = f"output_video_{int(time.time())}.avi"
-        output_path = os.path.join(os.getcwd(), output_filename)
-        
-        # Process video
-        result = process_video_file(video_path, output_path)
+        key, video_path = spool_video(file, file.filename, options)
         
+        output_path = outputs.temp_path(key)
+        if stream:
+            # Per-frame and per-second records aren't stored with the output,
+            # so a streamed request always processes the video
+            slot = admit_video_stream(video_path)
+            records = video_stream(slot, key, video_path, output_path, options, stream)
+            return Response(stream_with_context(records), mimetype=NDJSON_MIMETYPE)
+        # The same input with the same settings was processed before
+        summary = cached_video(key, video_path)
+        if summary is not None:
+            return jsonify(summary)
+        body, status = run_video(key, video_path, output_path, options)
+        return jsonify(body), status
+    
+    except admission.Rejected:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def video_request_options(values):
+    """(video_options, stream granularity or None) from the upload's form/query values"""
+    options = video_options(values)
+    stream = values.get('stream') or None
+    if stream and stream not in STREAM_GRANULARITIES:
+        raise ValueError(f"stream must be one of {', '.join(STREAM_GRANULARITIES)}")
+    return options, stream
+
+def spool_video(file, filename, options):
+    """Give an uploaded video a spool path, hashing it; returns (store key, path)"""
+    hasher = hashlib.sha256()
+    video_path = spool.spool_file(file, os.path.splitext(filename)[1].lower(), hasher)
+    return outputs.key(hasher.hexdigest(), dict(output_settings(), **options)), video_path
+
+def cached_video(key, video_path):
+    """Summary of an already stored output for key, or None; drops the spooled input on a hit"""
+    entry = outputs.get(key)
+    if entry is None:
+        return None
+    os.remove(video_path)
+    return video_summary(entry['filename'], entry['result'], cached=True)
+
+def run_video(key, video_path, output_path, options):
+    """Process a spooled video into the output store; returns (response body, status)"""
+    # Process video, holding an admission slot for the whole job. Frames
+    # are decoded into one reused buffer, so the reservation only needs to
+    # cover a few frames however long the video is.
+    try:
+        with admission.controller.admit(video_upload_cost(video_path)):
+            result = process_video_file(video_path, output_path, **options)
+    finally:
         # Clean up input file
         if os.path.exists(video_path):
             os.remove(video_path)
-        
-        if result['success']:
-            return jsonify({
-                'success': True,
-                'type': 'video',
-                'message': 'Video processed successfully!',
-                'output_file': output_filename,
-                'stats': result['stats'],
-                'total_frames': result['total_frames'],
-                'detection_summary': result['detection_summary']
-            })
-        else:
-            return jsonify({'error': result['error']}), 500
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    
+    if result['success']:
+        entry = outputs.put(key, output_path, result)
+        return video_summary(entry['filename'], result), 200
+    else:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return {'error': result['error']}, 500
 
-def process_video_file(input_path, output_path):
-    """Process video file and create output with detections"""
+def video_summary(output_filename, result, cached=False):
+    return {
+        'success': True,
+        'type': 'video',
+        'message': 'Video processed successfully!',
+        'output_file': output_filename,
+        'cached': cached,
+        'stats': result['stats'],
+        'total_frames': result['total_frames'],
+        'detection_summary': result['detection_summary']
+    }
+
+def admit_video_stream(video_path):
+    """Admission slot for a streamed video job, as an ExitStack for video_stream
+    
+    The slot is taken before the response starts, so a busy server still
+    answers 503, and is held until the stream ends or the client goes away.
+    """
+    slot = ExitStack()
     try:
-        cap = cv2.VideoCapture(input_path)
-        
-        if not cap.isOpened():
-            return {'success': False, 'error': 'Could not open video file'}
+        slot.enter_context(admission.controller.admit(video_upload_cost(video_path)))
+    except admission.Rejected:
+        os.remove(video_path)
+        raise
+    return slot
+
+def video_stream(slot, key, video_path, output_path, options, granularity):
+    """NDJSON lines emitted while the video is processed; releases slot when done"""
+    with slot:
+        try:
+            for record in video_job(video_path, output_path, granularity=granularity, **options):
+                if isinstance(record, str):
+                    yield record + '\n'
+                    continue
+                if record['type'] == 'summary':
+                    entry = outputs.put(key, output_path, record['result'])
+                    record = dict(video_summary(entry['filename'], record['result']), type='summary')
+                yield json.dumps(record) + '\n'
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+        finally:
+            for path in (video_path, output_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+def video_upload_cost(video_path):
+    """Estimate peak memory for a video job from its frame size"""
+    cap = cv2.VideoCapture(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return admission.video_cost(width, height)
+
+# When the next sampled frame is further ahead than this, seek instead of
+# grabbing through the gap
+SEEK_MIN_SECONDS = 10.0
+
+# Streaming video responses: one record per frame or per second of video,
+# plus a progress record this often (seconds)
+STREAM_GRANULARITIES = ('frame', 'second')
+# Lowest sampling rate: one analysed frame every ten seconds
+MIN_SAMPLE_FPS = 0.1
+NDJSON_MIMETYPE = 'application/x-ndjson'
+PROGRESS_INTERVAL = 1.0
+
+def video_options(form):
+    """Time range and sampling options for a video job from the upload form
+    
+    ``start``/``end`` are seconds into the video and ``sample_fps`` is how many
+    frames per second to analyse (default: every frame).
+    """
+    def number(name):
+        value = form.get(name, '').strip()
+        if not value:
+            return None
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(f"{name} must be a finite number")
+        if value < 0:
+            raise ValueError(f"{name} must not be negative")
+        return value
+    
+    options = {'start': number('start') or 0.0, 'end': number('end'), 'sample_fps': number('sample_fps')}
+    if options['end'] is not None and options['end'] <= options['start']:
+        raise ValueError("end must be after start")
+    if options['sample_fps'] is not None and options['sample_fps'] < MIN_SAMPLE_FPS:
+        raise ValueError(f"sample_fps must be at least {MIN_SAMPLE_FPS:g}")
+    return options
+
+def sampled_frames(cap, fps, start=0.0, end=None, sample_fps=None):
+    """Yield (frame_index, frame) for the frames of a job
+    
+    Frames outside the sample are skipped with grab(), which demuxes without
+    decoding, or by seeking when the gap is long. The same frame buffer is
+    decoded into on every iteration.
+    """
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    index = 0
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000.0)
+        index = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    end_index = int(end * fps) if end is not None else None
+    step = fps / sample_fps if sample_fps and sample_fps < fps else 1.0
+    next_sample = float(index)
+    frame = None
+    
+    while True:
+        target = int(round(next_sample))
+        if end_index is not None and target >= end_index:
+            return
+        if target - index > SEEK_MIN_SECONDS * fps and (not total_frames or target < total_frames):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            index = target
+        while index < target:
+            with profiling.stage('grab'):
+                grabbed = cap.grab()
+            if not grabbed:
+                return
+            index += 1
         
+        with profiling.stage('decode'):
+            ret, frame = cap.read(frame)
+        if not ret:
+            return
+        yield index, frame
+        index += 1
+        next_sample += step
+
+def video_job(input_path, output_path, start=0.0, end=None, sample_fps=None, granularity=None):
+    """Process a video, yielding NDJSON-ready records as it goes
+    
+    With ``granularity`` set to ``'frame'`` or ``'second'`` this yields a
+    ``start`` record, per-frame detections or per-second aggregates, and a
+    ``progress`` record every PROGRESS_INTERVAL seconds; frame records are
+    yielded pre-serialised as strings. The last record is
+    always ``{'type': 'summary', 'result': ...}``. Only the current second is
+    kept in memory, never the full result set.
+    """
+    cap = cv2.VideoCapture(input_path)
+    
+    if not cap.isOpened():
+        raise IOError('Could not open video file')
+    
+    out = None
+    try:
         # Get video properties
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
+        # Frames the job will cover, and how many of them get analysed
+        first_frame = int(start * fps)
+        last_frame = min(total_frames, int(end * fps)) if end is not None else total_frames
+        frames_in_range = max(0, last_frame - first_frame)
+        sampling = sample_fps is not None and sample_fps < fps
+        output_fps = sample_fps if sampling else fps
+        expected_frames = max(1, int(frames_in_range * output_fps / fps))
+        
         # Define codec and create VideoWriter - use more compatible codec
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
         # Change extension to .avi for better compatibility
         output_path = output_path.replace('.mp4', '.avi')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        
+        # A sampled job plays back in real time at the sampling rate
+        out = cv2.VideoWriter(output_path, fourcc, output_fps, (width, height))
+        if not out.isOpened():
+            raise IOError('Could not create the output video')
         
         frame_count = 0
-        total_detections = 0
-        detection_summary = defaultdict(int)
+        # Per-class totals as an array aligned with VEHICLE_NAMES
+        class_totals = np.zeros(len(VEHICLE_NAMES), dtype=np.int64)
         
-        print(f"Processing video: {total_frames} frames at {fps} FPS")
+        print(f"Processing video: {expected_frames} of {total_frames} frames at {fps:g} FPS")
+        job_start = time.perf_counter()
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
+        if granularity:
+            yield {'type': 'start', 'fps': fps, 'width': width, 'height': height,
+                   'total_frames': total_frames, 'frames_in_range': frames_in_range,
+                   'expected_frames': expected_frames}
+        second = None
+        next_progress = job_start + PROGRESS_INTERVAL
+        last_index = None
+        
+        for frame_index, frame in sampled_frames(cap, fps, start, end, sample_fps):
+            last_index = frame_index
             # Detect vehicles in frame
-            detections, error = detect_vehicles(frame)
+            detections, error = detect_vehicles(frame, source='video')
+            if error:
+                detections = detection_batch.DetectionBatch()
             
-            if not error and detections:
+            if detections:
                 # Draw detections
-                frame = draw_detections(frame, detections)
+                with profiling.stage('draw'):
+                    frame = draw_detections(frame, detections)
                 
                 # Update statistics
-                total_detections += len(detections)
-                for det in detections:
-                    detection_summary[det['class']] += 1
+                counts = detections.counts()
+                class_totals += counts
             
             # Write frame to output video
-            out.write(frame)
+            with profiling.stage('encode'):
+                out.write(frame)
             frame_count += 1
             
+            if granularity == 'frame':
+                # Already-serialised record: detections go straight from the
+                # arrays to JSON
+                yield (f'{{"type": "frame", "frame": {frame_index}, "time": {round(frame_index / fps, 3)}, '
+                       f'"detections": {detections.to_json()}}}')
+            elif granularity == 'second':
+                current = int(frame_index / fps)
+                if second is not None and current != second[0]:
+                    yield second_record(*second)
+                    second = None
+                if second is None:
+                    second = [current, 0, np.zeros(len(VEHICLE_NAMES), dtype=np.int64)]
+                second[1] += 1
+                if detections:
+                    second[2] += counts
+            
             # Progress update
             if frame_count % 30 == 0:  # Every 30 frames
-                progress = (frame_count / total_frames) * 100
-                print(f"Progress: {progress:.1f}% ({frame_count}/{total_frames} frames)")
+                progress = min(frame_count / expected_frames, 1.0) * 100
+                print(f"Progress: {progress:.1f}% ({frame_count}/{expected_frames} frames)")
+            if granularity and time.perf_counter() >= next_progress:
+                elapsed = time.perf_counter() - job_start
+                yield {'type': 'progress', 'frames': frame_count, 'expected_frames': expected_frames,
+                       'percent': round(min(frame_count / expected_frames, 1.0) * 100, 1),
+                       'elapsed': round(elapsed, 2), 'fps': round(frame_count / elapsed, 1)}
+                next_progress = time.perf_counter() + PROGRESS_INTERVAL
         
+        if second is not None:
+            yield second_record(*second)
+    finally:
         # Release everything
         cap.release()
-        out.release()
-        
-        return {
-            'success': True,
-            'total_frames': frame_count,
-            'stats': {
-                'total_detections': total_detections,
-                'detection_summary': dict(detection_summary)
-            },
-            'detection_summary': dict(detection_summary)
-        }
-        
+        if out is not None:
+            out.release()
+    
+    job_seconds = time.perf_counter() - job_start
+    if frame_count and job_seconds > 0:
+        metrics.VIDEO_JOB_FPS.observe(frame_count / job_seconds)
+    
+    # Each analysed frame stands for this many frames of the range, so
+    # totals can be scaled back up to the whole window
+    sampling_factor = frames_in_range / frame_count if sampling and frame_count else 1.0
+    
+    total_detections = int(class_totals.sum())
+    detection_summary = {name: int(n) for name, n in zip(VEHICLE_NAMES, class_totals) if n}
+    yield {'type': 'summary', 'result': {
+        'success': True,
+        'total_frames': frame_count,
+        'stats': {
+            'total_detections': total_detections,
+            'detection_summary': detection_summary,
+            'start': start,
+            # The video may end before the requested end, or its frame
+            # count may be wrong, so report how far the job really got
+            'end': round(last_index / fps, 3) if last_index is not None else start,
+            'sample_fps': output_fps,
+            'frames_in_range': frames_in_range,
+            'frames_analyzed': frame_count,
+            'sampling_factor': round(sampling_factor, 4),
+            'estimated_total_detections': round(total_detections * sampling_factor)
+        },
+        'detection_summary': detection_summary
+    }}
+
+def second_record(second, frames, counts):
+    """Per-second aggregate for a streamed video job"""
+    return {'type': 'second', 'second': second, 'frames': frames, 'detections': int(counts.sum()),
+            'vehicles': {name: int(n) for name, n in zip(VEHICLE_NAMES, counts) if n}}
+
+def process_video_file(input_path, output_path, start=0.0, end=None, sample_fps=None):
+    """Process video file and create output with detections
+    
+    Only the ``start``..``end`` window (seconds) is processed, at
+    ``sample_fps`` frames per second when given.
+    """
+    try:
+        for record in video_job(input_path, output_path, start, end, sample_fps):
+            pass
+        return record['result']
+    
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
@@ -291,46 +1061,115 @@ def process_video_file(input_path, output_path):
 def download_file(filename):
     """Download processed video file"""
     try:
-        file_path = os.path.join(os.getcwd(), filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        file_path = outputs.lookup(filename)
+        if file_path is not None:
+            # Byte ranges let players seek and resume; outputs never change
+            # once written, so clients may cache them and revalidate by ETag
+            return send_file(os.path.abspath(file_path), as_attachment=True, conditional=True,
+                             etag=True, max_age=86400)
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_settings():
+    """Show or change the share of requests that are profiled"""
+    if not admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            if 'sample_rate' in data:
+                profiling.settings['sample_rate'] = min(max(float(data['sample_rate']), 0.0), 1.0)
+            if 'interval_ms' in data:
+                profiling.settings['interval_ms'] = max(float(data['interval_ms']), 1.0)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'sample_rate and interval_ms must be numbers'}), 400
+    
+    return jsonify(profiling.settings)
+
+@app.route('/profiles')
+def get_profiles():
+    """List stored request profiles, newest first"""
+    if not admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(profiling.list_profiles())
+
+@app.route('/profiles/<profile_id>/<kind>')
+def download_profile(profile_id, kind):
+    """Download a profile as Chrome trace (trace.json) or folded stacks (stacks.folded)"""
+    if not admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    path = profiling.profile_file(profile_id, kind)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), mimetype=profiling.PROFILE_FILES[kind],
+                     as_attachment=True, download_name=f"{profile_id}-{kind}")
+
 @app.route('/stats')
 def get_stats():
     """Get detection statistics for dashboard"""
-    return jsonify(detection_stats)
+    return jsonify(stats_snapshot())
+
+def stats_snapshot():
+    """Consistent copy of detection_stats, plus the model pool's state, for serialising"""
+    with stats_lock:
+        snapshot = dict(detection_stats, vehicle_counts=dict(detection_stats['vehicle_counts']),
+                        detection_history=list(detection_stats['detection_history']))
+    snapshot['model_pool'] = models.stats() if models else None
+    return snapshot
 
 @app.route('/history')
 def get_history():
-    """Get detection history for charts"""
-    history = detection_stats['detection_history']
+    """Get detection history for charts
     
-    # Convert to DataFrame for easier processing
-    df = pd.DataFrame(history)
+    Optional query parameters: ``start``/``end`` (epoch seconds, default the
+    last hour), ``resolution`` (minute, hour or day; picked from the range
+    when omitted) and ``source`` (image or video).
+    """
+    body, status = history_chart(request.args)
+    return jsonify(body), status
+
+def history_chart(args):
+    """Chart series for the /history query arguments; returns (response body, status)"""
+    try:
+        end = float(args.get('end', time.time()))
+        start = float(args.get('start', end - 3600))
+    except ValueError:
+        return {'error': 'start and end must be epoch seconds'}, 400
+    resolution = args.get('resolution') or detection_store.pick_resolution(start, end)
+    if resolution not in detection_store.RESOLUTIONS:
+        return {'error': f"resolution must be one of {', '.join(detection_store.RESOLUTIONS)}"}, 400
     
-    if df.empty:
-        return jsonify({'timestamps': [], 'detections': [], 'vehicles': {}})
+    buckets = history_store.history(start, end, resolution, args.get('source'))
     
     # Prepare data for charts
-    timestamps = [time.strftime('%H:%M:%S', time.localtime(ts)) for ts in df['timestamp']]
-    detection_counts = df['detections'].tolist()
+    label_format = {'minute': '%H:%M', 'hour': '%m-%d %H:00', 'day': '%Y-%m-%d'}[resolution]
+    timestamps = [time.strftime(label_format, time.localtime(b['bucket'])) for b in buckets]
+    detection_counts = [b['detections'] for b in buckets]
     
     # Vehicle counts over time
     vehicle_data = {}
     for vehicle in ['car', 'motorcycle', 'bus', 'truck']:
-        vehicle_data[vehicle] = [entry.get(vehicle, 0) for entry in df['vehicles']]
+        vehicle_data[vehicle] = [b['vehicles'].get(vehicle, 0) for b in buckets]
     
-    return jsonify({
+    return {
         'timestamps': timestamps,
         'detections': detection_counts,
-        'vehicles': vehicle_data
-    })
+        'vehicles': vehicle_data,
+        'frames': [b['frames'] for b in buckets],
+        'resolution': resolution
+    }, 200
 
 if __name__ == '__main__':
+    setup()
     # Initialize model in a separate thread
     threading.Thread(target=initialize_model).start()
     app.run(debug=True, host='0.0.0.0', port=5000)
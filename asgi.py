@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+ASGI front end for the vehicle detection service
+
+Serves the same dashboard and ``/upload``, ``/upload/batch``, ``/download``,
+``/stats``, ``/history`` and ``/metrics`` API as app.py, but connection I/O
+runs on an asyncio event loop: upload bodies are received, downloads sent and
+NDJSON results streamed without holding a thread, so an idle or slow client
+costs a coroutine rather than a server thread. Decode and inference run in a bounded thread pool
+(``INFERENCE_WORKERS``) using the same functions, model pool, admission
+control and output store as the Flask server:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The admin and profile-download endpoints stay on the Flask server.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from flask import render_template
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import admission
+import app as service
+import detection_batch
+import metrics
+import profiling
+
+# Threads for decode and inference jobs. Every accepted job gets its own
+# thread, so by default there is one for each admission slot and queue place;
+# admission control then decides who runs and who waits.
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS',
+                                       admission.controller.max_concurrent + admission.controller.max_queue))
+
+class InferenceExecutor:
+    """Bounded thread pool for blocking decode and inference work
+    
+    At most ``workers`` jobs are accepted at once; past that new jobs are
+    rejected immediately instead of queueing behind the pool. Only the event
+    loop thread reserves and releases places, so no lock is needed.
+    """
+    
+    def __init__(self, workers):
+        self.workers = workers
+        self.active = 0
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='inference')
+    
+    def reserve(self):
+        if self.active >= self.workers:
+            admission.REJECTED.inc(reason='executor_full')
+            raise admission.Rejected("Server busy, retry later", retry_after=admission.controller.retry_after())
+        self.active += 1
+    
+    def release(self):
+        self.active -= 1
+    
+    def submit(self, fn, *args):
+        """Start fn(*args) on a pool thread; the caller must hold a place"""
+        return self._pool.submit(fn, *args)
+    
+    def release_when_done(self, future, callback=None):
+        """Give the place back once future's thread is free, even if its request was cancelled"""
+        loop = asyncio.get_running_loop()
+        
+        def done(finished):
+            if callback is not None:
+                callback(finished)
+            loop.call_soon_threadsafe(self.release)
+        future.add_done_callback(done)
+    
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool and await its result; raises admission.Rejected when full"""
+        self.reserve()
+        future = self.submit(fn, *args)
+        self.release_when_done(future)
+        return await asyncio.wrap_future(future)
+    
+    async def stream(self, fn, *args):
+        """Run fn(*args) on the pool for a blocking iterator; returns a PoolStream over it
+        
+        The call and the first step both happen before any response is sent,
+        so a rejection still becomes a proper error response, and a generator
+        has started (and will run its cleanup when closed) before the client
+        can go away. The place is held until the PoolStream is closed.
+        """
+        self.reserve()
+        future = self.submit(start_stream, fn, args)
+        try:
+            iterator, first = await asyncio.wrap_future(future)
+        except BaseException:
+            self.release_when_done(future, abandon_stream)
+            raise
+        return PoolStream(self, iterator, first)
+    
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+def start_stream(fn, args):
+    iterator = fn(*args)
+    return iterator, next(iterator, None)
+
+def close_iterator(iterator):
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+
+def abandon_stream(future):
+    # The request went away while the stream was starting
+    if not future.cancelled() and future.exception() is None:
+        close_iterator(future.result()[0])
+
+class PoolStream:
+    """Async iterator over a started blocking iterator, advanced on the executor's pool"""
+    
+    def __init__(self, executor, iterator, first):
+        self._executor = executor
+        self._iterator = iterator
+        self._first = first
+        self._step = None
+        self._closed = False
+    
+    async def __aiter__(self):
+        item = self._first
+        while item is not None:
+            yield item
+            self._step = self._executor.submit(next, self._iterator, None)
+            item = await asyncio.wrap_future(self._step)
+    
+    def close(self):
+        """Close the iterator on the pool after any step still running, then free the place"""
+        if self._closed:
+            return
+        self._closed = True
+        step, iterator = self._step, self._iterator
+        
+        def finish():
+            if step is not None:
+                futures.wait([step])
+            close_iterator(iterator)
+        self._executor.release_when_done(self._executor.submit(finish))
+
+class PoolStreamingResponse(StreamingResponse):
+    """StreamingResponse that always closes its PoolStream, even when the client left early"""
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.body_iterator.close()
+
+executor = InferenceExecutor(INFERENCE_WORKERS)
+metrics.gauge('vehicle_executor_active_jobs', 'Decode/inference jobs holding an ASGI executor thread',
+              function=lambda: executor.active)
+
+def json_job(fn, args, profile_name=None):
+    """Pool-thread body of a JSON endpoint; returns (encoded body, status, profile id)
+    
+    The result is serialised here too, so a large base64 image never blocks
+    the event loop.
+    """
+    profile = profiling.start(profile_name) if profile_name else None
+    status = 500
+    try:
+        body, status = fn(*args)
+        content = detection_batch.dumps(body).encode('utf-8')
+    finally:
+        profile_id = profiling.finish(profile, status) if profile is not None else None
+    return content, status, profile_id
+
+async def json_response(request, fn, *args):
+    """Run a (body, status) job on the executor and wrap it in a JSON response"""
+    profile_name = None
+    if profiling.should_profile(request.headers):
+        profile_name = f"{request.method} {request.url.path}"
+    content, status, profile_id = await executor.run(json_job, fn, args, profile_name)
+    headers = {'X-Profile-Id': profile_id} if profile_id else None
+    return Response(content, status, headers=headers, media_type='application/json')
+
+def rejected_response(error):
+    """Response for a request turned away by admission control"""
+    headers = {'Retry-After': str(error.retry_after)} if error.retry_after else None
+    return JSONResponse({'error': str(error), 'retry_after': error.retry_after}, error.status, headers=headers)
+
+def image_upload_job(file, upload_bytes, annotate):
+    min_side = service.decode_min_side(annotate)
+    with admission.controller.admit(service.image_upload_cost(file, upload_bytes, min_side)):
+        return service.analyze_image(file.read(), annotate)
+
+def video_upload_job(file, filename, options):
+    key, video_path = service.spool_video(file, filename, options)
+    summary = service.cached_video(key, video_path)
+    if summary is not None:
+        return summary, 200
+    return service.run_video(key, video_path, service.outputs.temp_path(key), options)
+
+def start_video_stream(file, filename, options, granularity):
+    """Spool the upload and take its admission slot; returns the NDJSON line iterator"""
+    key, video_path = service.spool_video(file, filename, options)
+    # Streamed records aren't stored with the output, so the cache is skipped
+    slot = service.admit_video_stream(video_path)
+    return service.video_stream(slot, key, video_path, service.outputs.temp_path(key), options, granularity)
+
+def length_error(request):
+    """Error response if the declared body size is missing or over the limit; checked before reading it"""
+    try:
+        length = int(request.headers['content-length'])
+    except KeyError:
+        return JSONResponse({'error': 'Content-Length required'}, 411)
+    except ValueError:
+        return JSONResponse({'error': 'Invalid Content-Length'}, 400)
+    if length > service.app.config['MAX_CONTENT_LENGTH']:
+        return JSONResponse({'error': 'Upload too large'}, 413)
+    return None
+
+def form_values(request, form):
+    """Query parameters overlaid with the form's text fields, like Flask's request.values"""
+    values = dict(request.query_params)
+    values.update((k, v) for k, v in form.multi_items() if isinstance(v, str))
+    return values
+
+async def upload_file(request):
+    error = length_error(request)
+    if error is not None:
+        return error
+    length = int(request.headers['content-length'])
+    
+    # The multipart body is parsed as it arrives; file parts roll over from
+    # memory to a temporary file once they pass 1 MB
+    async with request.form() as form:
+        upload = form.get('file')
+        if upload is None or isinstance(upload, str):
+            return JSONResponse({'error': 'No file uploaded'}, 400)
+        if not upload.filename:
+            return JSONResponse({'error': 'No file selected'}, 400)
+        
+        try:
+            file_extension = upload.filename.lower().split('.')[-1]
+            
+            if file_extension in service.IMAGE_EXTENSIONS:
+                request.state.request_type = 'image'
+                annotate = service.form_flag(form_values(request, form), 'annotate', default=True)
+                return await json_response(request, image_upload_job, upload.file, length, annotate)
+            elif file_extension in service.VIDEO_EXTENSIONS:
+                request.state.request_type = 'video'
+                try:
+                    options, stream = service.video_request_options(form_values(request, form))
+                except ValueError as e:
+                    return JSONResponse({'error': str(e)}, 400)
+                if stream:
+                    lines = await executor.stream(start_video_stream, upload.file, upload.filename, options, stream)
+                    return PoolStreamingResponse(lines, media_type=service.NDJSON_MIMETYPE)
+                return await json_response(request, video_upload_job, upload.file, upload.filename, options)
+            else:
+                return JSONResponse({'error': 'Unsupported file type. Please upload an image or video file.'}, 400)
+        
+        except admission.Rejected as e:
+            return rejected_response(e)
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, 500)
+
+def batch_upload_job(sources, annotate):
+    return service.batch_result(service.batch_job(sources, annotate)), 200
+
+async def upload_batch(request):
+    """Detect vehicles in many images: several 'files' parts and/or zip/tar archives"""
+    request.state.request_type = 'batch'
+    error = length_error(request)
+    if error is not None:
+        return error
+    
+    # A streamed batch keeps reading its uploads after this handler returns,
+    # so in that case batch_lines closes them
+    form = await request.form()
+    streaming = False
+    try:
+        uploads = [upload for upload in form.getlist('files') + form.getlist('file')
+                   if not isinstance(upload, str) and upload.filename]
+        if not uploads:
+            return JSONResponse({'error': 'No files uploaded'}, 400)
+        
+        try:
+            values = form_values(request, form)
+            annotate, stream = service.batch_request_options(values)
+            sources = await run_in_threadpool(service.batch_sources,
+                                              [(upload.filename, upload.file) for upload in uploads])
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        
+        try:
+            if stream:
+                lines = await executor.stream(service.batch_lines, sources, annotate,
+                                              [upload.file for upload in uploads])
+                streaming = True
+                return PoolStreamingResponse(lines, media_type=service.NDJSON_MIMETYPE)
+            return await json_response(request, batch_upload_job, sources, annotate)
+        except admission.Rejected as e:
+            return rejected_response(e)
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, 500)
+    finally:
+        if not streaming:
+            await form.close()
+
+def stored_output(filename):
+    path = service.outputs.lookup(filename)
+    return (path, os.stat(path)) if path is not None else (None, None)
+
+async def download_file(request):
+    """Download processed video file"""
+    filename = request.path_params['filename']
+    path, stat = await run_in_threadpool(stored_output, filename)
+    if path is None:
+        return JSONResponse({'error': 'File not found'}, 404)
+    # Byte ranges are served by FileResponse; outputs never change once
+    # written, so a conditional request that matches is answered without a body
+    response = FileResponse(path, stat_result=stat, filename=filename,
+                            headers={'Cache-Control': 'public, max-age=86400'})
+    if not_modified(request.headers, response.headers['etag'], stat.st_mtime):
+        return Response(status_code=304, headers={'ETag': response.headers['etag'],
+                                                  'Last-Modified': response.headers['last-modified'],
+                                                  'Cache-Control': 'public, max-age=86400'})
+    return response
+
+def not_modified(headers, etag, mtime):
+    """Whether If-None-Match, or failing that If-Modified-Since, says the client's copy is current"""
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag.removeprefix('W/') in tags
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # Last-Modified has whole-second resolution
+    return int(mtime) <= since
+
+async def index(request):
+    """Dashboard page, rendered from the same template as app.py"""
+    with service.app.app_context():
+        return HTMLResponse(render_template('index.html'))
+
+async def get_stats(request):
+    """Get detection statistics for dashboard"""
+    return JSONResponse(service.stats_snapshot())
+
+async def get_history(request):
+    """Get detection history for charts (same query parameters as app.py)"""
+    body, status = await run_in_threadpool(service.history_chart, request.query_params)
+    return JSONResponse(body, status)
+
+async def get_metrics(request):
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+class CountRequests:
+    """ASGI middleware counting every request by type and status, like app.py's after_request hook"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = [500]
+        
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = scope.get('endpoint')
+            request_type = scope.get('state', {}).get('request_type', endpoint.__name__ if endpoint else 'unknown')
+            metrics.REQUESTS.inc(type=request_type, status=status[0])
+
+@asynccontextmanager
+async def lifespan(app):
+    service.setup()
+    # Load the model pool in the background so the server answers /stats
+    # while ultralytics/torch is still importing
+    threading.Thread(target=service.initialize_model, daemon=True).start()
+    yield
+    executor.shutdown()
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/upload', upload_file, methods=['POST']),
+        Route('/upload/batch', upload_batch, methods=['POST']),
+        Route('/download/{filename}', download_file),
+        Route('/stats', get_stats),
+        Route('/history', get_history),
+        Route('/metrics', get_metrics),
+    ],
+    middleware=[Middleware(CountRequests), Middleware(CORSMiddleware, allow_origins=['*'])],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
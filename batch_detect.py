@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Headless batch vehicle detection over a folder of images and videos
+
+Files are hashed up front and sharded across a process pool: images go to
+workers in chunks and are run through the model in batches of the tuned
+``batch_size``; each video is one task. Every successfully processed file is
+appended to ``manifest.jsonl`` in the output directory, keyed by the SHA-256
+of its content and a digest of the detection settings, so an interrupted run
+picks up where it stopped, files that failed are retried, and renamed or
+duplicated files are not processed twice:
+
+    python batch_detect.py /data/snapshots --output nightly --annotate
+
+Image detections are stored in the manifest. Video detections are written as
+``<hash>.detections.jsonl`` sidecars that ``play_video.py --sidecar`` can
+overlay. ``--annotate`` also writes annotated copies under ``annotated/``.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import detection_batch
+import output_store
+import tuning
+from detection_batch import CONFIDENCE_THRESHOLD, VEHICLE_CLASSES, VEHICLE_NAMES, DetectionBatch
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv'}
+MANIFEST_NAME = 'manifest.jsonl'
+
+HASH_CHUNK = 1024 * 1024
+# Images handed to a worker per task, in multiples of the inference batch
+BATCHES_PER_TASK = 8
+
+def find_inputs(root, recursive=True, exclude=()):
+    """Image and video files under root, sorted, skipping the ``exclude`` directories"""
+    excluded = {os.path.realpath(path) for path in exclude}
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames
+                             if os.path.realpath(os.path.join(dirpath, name)) not in excluded)
+        for name in sorted(filenames):
+            ext = os.path.splitext(name)[1].lower()
+            if ext in IMAGE_EXTENSIONS or ext in VIDEO_EXTENSIONS:
+                found.append(os.path.join(dirpath, name))
+        if not recursive:
+            break
+    return found
+
+def file_hash(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(HASH_CHUNK)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def load_manifest(path):
+    """Completed records by content hash; a torn last line is ignored
+    
+    Error records, written by earlier versions, don't count as completed.
+    """
+    done = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'error' not in record:
+                    done[record['hash']] = record
+    except FileNotFoundError:
+        pass
+    return done
+
+# State set up once in each worker process by init_worker
+_worker = {}
+
+def init_worker(model_path, predict_kwargs, threads, settings, output_dir, root, annotate):
+    import cv2
+    cv2.setNumThreads(1)
+    tuning.apply_threads(threads)
+    if model_path == 'stub':
+        from stub_detector import StubYOLO
+        model = StubYOLO()
+    else:
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+    # verbose=False stops ultralytics logging a line per image and frame
+    _worker.update(model=model, predict_kwargs=dict(predict_kwargs, verbose=False), settings=settings,
+                   output_dir=output_dir, root=root, annotate=annotate)
+
+def annotated_path(path, extension=None):
+    relative = os.path.relpath(path, _worker['root'])
+    if extension:
+        relative = os.path.splitext(relative)[0] + extension
+    out_path = os.path.join(_worker['output_dir'], 'annotated', relative)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    return out_path
+
+def process_images(pending, batch_size):
+    """Detect vehicles in a chunk of (path, hash) images, batch_size images per model call"""
+    import cv2
+    from play_video import draw_overlay
+    
+    records = []
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        began = time.perf_counter()
+        images = []
+        loaded = []
+        for path, digest in chunk:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                records.append({'hash': digest, 'path': path, 'type': 'image',
+                                'settings': _worker['settings'], 'error': 'unreadable image'})
+                continue
+            images.append(image)
+            loaded.append((path, digest))
+        if not images:
+            continue
+        
+        results = _worker['model'](images, **_worker['predict_kwargs'])
+        seconds = (time.perf_counter() - began) / len(images)
+        for (path, digest), image, result in zip(loaded, images, results):
+            # Sent back to the parent in the batch's binary form, not as dicts
+            detections = DetectionBatch.from_result(result)
+            record = {'hash': digest, 'path': path, 'type': 'image', 'settings': _worker['settings'],
+                      'detections': detections, 'vehicle_count': detections.count_by_name(),
+                      'seconds': round(seconds, 4)}
+            if _worker['annotate']:
+                record['output'] = annotated_path(path)
+                cv2.imwrite(record['output'], draw_overlay(image, detections))
+            records.append(record)
+    return records
+
+def process_video(path, digest):
+    """Detect vehicles in every frame of a video; writes a detections sidecar"""
+    import cv2
+    from play_video import draw_overlay
+    
+    began = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return [{'hash': digest, 'path': path, 'type': 'video',
+                 'settings': _worker['settings'], 'error': 'could not open video'}]
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    writer = None
+    record = {'hash': digest, 'path': path, 'type': 'video', 'settings': _worker['settings']}
+    if _worker['annotate']:
+        record['output'] = annotated_path(path, '.avi')
+        writer = cv2.VideoWriter(record['output'], cv2.VideoWriter_fourcc(*'XVID'), fps, (width, height))
+    
+    # Written under a temporary name so a killed run never leaves a sidecar
+    # that looks complete
+    sidecar = os.path.join(_worker['output_dir'], digest + '.detections.jsonl')
+    tmp_sidecar = sidecar + '.part'
+    class_totals = np.zeros(len(VEHICLE_NAMES), dtype=np.int64)
+    frame_count = 0
+    frame = None
+    with open(tmp_sidecar, 'w', encoding='utf-8') as fh:
+        while True:
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            detections = DetectionBatch.from_result(_worker['model'](frame, **_worker['predict_kwargs'])[0])
+            fh.write(f'{{"frame": {frame_count}, "time": {round(frame_count / fps, 4)}, '
+                     f'"detections": {detections.to_json()}}}\n')
+            class_totals += detections.counts()
+            if writer is not None:
+                writer.write(draw_overlay(frame, detections))
+            frame_count += 1
+    cap.release()
+    if writer is not None:
+        writer.release()
+    os.replace(tmp_sidecar, sidecar)
+    
+    vehicle_count = {name: int(n) for name, n in zip(VEHICLE_NAMES, class_totals) if n}
+    record.update(detections_file=sidecar, frames=frame_count, vehicle_count=vehicle_count,
+                  seconds=round(time.perf_counter() - began, 3))
+    return [record]
+
+def run_batch(root, output_dir='batch_output', jobs=None, batch_size=None, model_path=None,
+              annotate=False, recursive=True, config_path=None):
+    """Process every image and video under root; returns the new manifest records"""
+    config = tuning.load_tuned_config(config_path)
+    model_path = model_path or config['model']
+    batch_size = batch_size or config['batch_size'] or 1
+    predict_kwargs = tuning.predict_kwargs(config)
+    # Runs with --annotate write outputs the others don't, so it is part of the settings
+    settings = output_store.settings_digest({'model': model_path, 'classes': VEHICLE_CLASSES,
+                                             'confidence': CONFIDENCE_THRESHOLD, 'predict': predict_kwargs,
+                                             'annotate': annotate})
+    
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    done = {h for h, r in load_manifest(manifest_path).items() if r.get('settings') == settings}
+    
+    # Annotated copies from earlier runs would otherwise be picked up as inputs
+    files = find_inputs(root, recursive, exclude=(output_dir, os.path.join(output_dir, 'annotated')))
+    if not files:
+        print("No images or videos found.")
+        return []
+    
+    jobs = jobs or os.cpu_count() or 1
+    # Hash everything first, so files already in the manifest and files with
+    # identical contents are skipped before they reach a worker
+    with ThreadPoolExecutor(max_workers=jobs) as hashers:
+        digests = list(hashers.map(file_hash, files))
+    first_path = {}
+    duplicates = {}
+    for path, digest in zip(files, digests):
+        if digest in first_path:
+            duplicates.setdefault(digest, []).append(path)
+        else:
+            first_path[digest] = path
+    pending = [(path, digest) for digest, path in first_path.items() if digest not in done]
+    images = [(p, d) for p, d in pending if os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS]
+    videos = [(p, d) for p, d in pending if os.path.splitext(p)[1].lower() in VIDEO_EXTENSIONS]
+    
+    # Split the cores between workers instead of letting each use all of them
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    print(f"Found {len(files)} file(s): {len(first_path) - len(pending)} already in the manifest, "
+          f"{len(files) - len(first_path)} duplicate(s), {len(images)} image(s) and {len(videos)} video(s) to process")
+    print(f"{jobs} worker(s), {threads} thread(s) each, image batch size {batch_size}")
+    
+    tasks = []
+    task_size = batch_size * BATCHES_PER_TASK
+    records = []
+    next_report = 100
+    wall_start = time.perf_counter()
+    with open(manifest_path, 'a', encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                initargs=(model_path, predict_kwargs, threads, settings,
+                                          output_dir, root, annotate)) as pool:
+        # Videos first: they are the longest tasks
+        for video, digest in videos:
+            tasks.append(pool.submit(process_video, video, digest))
+        for start in range(0, len(images), task_size):
+            tasks.append(pool.submit(process_images, images[start:start + task_size], batch_size))
+        
+        for future in as_completed(tasks):
+            try:
+                finished = future.result()
+            except Exception as e:
+                print(f"  ❌ task failed: {e}")
+                continue
+            for record in finished:
+                records.append(record)
+                if 'error' in record:
+                    # Not recorded, so the next run tries the file again
+                    print(f"  ❌ {record['path']}: {record['error']}")
+                    continue
+                if record['hash'] in duplicates:
+                    record['duplicates'] = duplicates[record['hash']]
+                # One line per file, flushed immediately, so a crash loses at
+                # most the files still in flight
+                manifest.write(detection_batch.dumps(record) + '\n')
+                manifest.flush()
+                if record['type'] == 'video':
+                    print(f"  ✅ {record['path']}: {record['frames']} frames, {record['vehicle_count']}")
+            if len(records) >= next_report:
+                print(f"  ... {len(records)} file(s) done")
+                next_report += 100
+    
+    wall = max(time.perf_counter() - wall_start, 1e-9)
+    errors = sum(1 for r in records if 'error' in r)
+    processed_images = sum(1 for r in records if r['type'] == 'image' and 'error' not in r)
+    print(f"\n🎉 Processed {len(records) - errors} file(s) ({errors} failed) in {wall:.1f}s")
+    if processed_images:
+        print(f"Images: {processed_images / wall:.1f}/s")
+    print(f"Manifest: {manifest_path}")
+    return records
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect vehicles in a folder of images and videos")
+    parser.add_argument('input', help="Directory to process")
+    parser.add_argument('-o', '--output', default='batch_output', help="Directory for the manifest and outputs")
+    parser.add_argument('-j', '--jobs', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--batch-size', type=int, help="Images per model call (default: tuned batch size)")
+    parser.add_argument('--model', help="Model file, or 'stub' for the deterministic test detector")
+    parser.add_argument('--config', help="Tuned config file (default: tuned_config.json)")
+    parser.add_argument('--annotate', action='store_true', help="Also write annotated images and videos")
+    parser.add_argument('--no-recursive', action='store_true', help="Only process the top-level directory")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_batch(args.input, args.output, jobs=args.jobs, batch_size=args.batch_size, model_path=args.model,
+              annotate=args.annotate, recursive=not args.no_recursive, config_path=args.config)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Stage-level performance benchmark for the vehicle detection pipeline
+
+Generates synthetic workloads with create_test_video.py and times each stage
+of the video path separately: decode, preprocess, inference and postprocess
+(as reported by the model), the vehicle filtering done in ``detect_vehicles``,
+``draw_detections`` and encode. Every combination of workload and
+configuration (backend, batch size, threads) is written to a JSON file with
+p50/p95/p99 latencies and FPS, which ``--compare`` diffs against an earlier run.
+
+Runs CPU-only with either a local model file or the stub detector:
+
+    python benchmark.py --backends stub,yolov8n.pt --batch-sizes 1,4 --threads 1,4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from app import draw_detections, extract_vehicle_detections
+from create_test_video import create_test_video
+from stub_detector import StubYOLO
+from tuning import apply_threads
+
+STAGES = ['decode', 'preprocess', 'inference', 'postprocess', 'filter', 'draw', 'encode']
+PERCENTILES = [50, 95, 99]
+
+def parse_list(value, cast=str):
+    return [cast(v.strip()) for v in value.split(',') if v.strip()]
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def workload_path(cache_dir, width, height, duration, density, fps):
+    """Generate (once) and return the synthetic clip for a workload"""
+    path = os.path.join(cache_dir, f"bench_{width}x{height}_{duration}s_d{density}_{fps}fps.mp4")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        create_test_video(path, width=width, height=height, fps=fps,
+                          duration=duration, density=density, verbose=False)
+    return path
+
+def load_backend(backend, density, stub_latency_ms):
+    if backend == 'stub':
+        # The synthetic clip draws four vehicles per density step
+        return StubYOLO(boxes_per_image=4 * density, latency_ms=stub_latency_ms)
+    from ultralytics import YOLO
+    return YOLO(backend)
+
+def summarize(samples):
+    """Percentile summary (milliseconds) of a list of samples"""
+    if not samples:
+        return None
+    values = np.asarray(samples, dtype=np.float64)
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+    summary['mean'] = round(float(values.mean()), 3)
+    return summary
+
+def run_case(video_path, model, batch_size, warmup):
+    """Run the pipeline over one clip; returns per-stage samples in ms"""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    out_fd, out_path = tempfile.mkstemp(suffix='.avi')
+    os.close(out_fd)
+    out = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*'XVID'), fps, (width, height))
+    
+    samples = defaultdict(list)
+    frames_seen = 0
+    measured_frames = 0
+    measured_seconds = 0.0
+    
+    try:
+        done = False
+        while not done:
+            # Decode a batch
+            batch = []
+            decode_ms = []
+            while len(batch) < batch_size:
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                elapsed = (time.perf_counter() - start) * 1000.0
+                if not ret:
+                    done = True
+                    break
+                batch.append(frame)
+                decode_ms.append(elapsed)
+            if not batch:
+                break
+            
+            batch_start = time.perf_counter()
+            results = model(batch, verbose=False)
+            
+            per_frame = []
+            for frame, result, decode_time in zip(batch, results, decode_ms):
+                stage = {'decode': decode_time}
+                speed = getattr(result, 'speed', None) or {}
+                for name in ('preprocess', 'inference', 'postprocess'):
+                    stage[name] = float(speed.get(name) or 0.0)
+                
+                start = time.perf_counter()
+                detections, _ = extract_vehicle_detections([result])
+                stage['filter'] = (time.perf_counter() - start) * 1000.0
+                
+                start = time.perf_counter()
+                frame = draw_detections(frame, detections)
+                stage['draw'] = (time.perf_counter() - start) * 1000.0
+                
+                start = time.perf_counter()
+                out.write(frame)
+                stage['encode'] = (time.perf_counter() - start) * 1000.0
+                per_frame.append(stage)
+            
+            batch_seconds = time.perf_counter() - batch_start + sum(decode_ms) / 1000.0
+            
+            # Warmup frames (model initialisation, caches) are not measured
+            if frames_seen >= warmup:
+                for stage in per_frame:
+                    for name, value in stage.items():
+                        samples[name].append(value)
+                    samples['total'].append(sum(stage.values()))
+                measured_frames += len(batch)
+                measured_seconds += batch_seconds
+            frames_seen += len(batch)
+    finally:
+        cap.release()
+        out.release()
+        os.remove(out_path)
+    
+    return samples, measured_frames, measured_seconds
+
+def case_key(run):
+    w, c = run['workload'], run['config']
+    return (w['width'], w['height'], w['duration'], w['density'],
+            c['backend'], c['batch_size'], c['threads'])
+
+def describe(run):
+    w, c = run['workload'], run['config']
+    return (f"{w['width']}x{w['height']} {w['duration']}s d{w['density']} | "
+            f"{c['backend']} b{c['batch_size']} t{c['threads']}")
+
+def compare(current, baseline_path):
+    """Print FPS and p95 changes against an earlier results file"""
+    with open(baseline_path, 'r', encoding='utf-8') as fh:
+        baseline = {case_key(r): r for r in json.load(fh)['runs']}
+    
+    print(f"\nComparison against {baseline_path}:")
+    for run in current['runs']:
+        old = baseline.get(case_key(run))
+        if old is None:
+            print(f"  {describe(run)}: no baseline")
+            continue
+        fps_change = (run['fps'] - old['fps']) / old['fps'] * 100 if old['fps'] else 0.0
+        old_p95 = old['stages']['total']['p95']
+        new_p95 = run['stages']['total']['p95']
+        p95_change = (new_p95 - old_p95) / old_p95 * 100 if old_p95 else 0.0
+        print(f"  {describe(run)}: FPS {old['fps']:.1f} -> {run['fps']:.1f} ({fps_change:+.1f}%), "
+              f"p95 {old_p95:.1f} -> {new_p95:.1f} ms ({p95_change:+.1f}%)")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stage-level benchmark for vehicle detection")
+    parser.add_argument('--resolutions', default='640x480,1280x720', help="Comma-separated WxH list")
+    parser.add_argument('--durations', default='2', help="Comma-separated clip durations in seconds")
+    parser.add_argument('--densities', default='1,4', help="Comma-separated vehicle densities")
+    parser.add_argument('--fps', type=int, default=30, help="Frame rate of generated clips")
+    parser.add_argument('--backends', default='stub',
+                        help="Comma-separated backends: 'stub' or model files (yolov8n.pt, yolov8n.onnx, ...)")
+    parser.add_argument('--batch-sizes', default='1', help="Comma-separated inference batch sizes")
+    parser.add_argument('--threads', default=str(os.cpu_count() or 1), help="Comma-separated thread counts")
+    parser.add_argument('--warmup', type=int, default=5, help="Frames to run before measuring")
+    parser.add_argument('--stub-latency', type=float, default=0.0,
+                        help="Simulated inference time per stub call in ms")
+    parser.add_argument('--cache-dir', default='bench_videos', help="Where generated clips are kept")
+    parser.add_argument('--output', default='bench_results.json', help="Results file (JSON)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run every workload/configuration combination"""
+    args = parse_args(argv)
+    
+    resolutions = parse_list(args.resolutions, parse_resolution)
+    durations = parse_list(args.durations, int)
+    densities = parse_list(args.densities, int)
+    backends = parse_list(args.backends)
+    batch_sizes = parse_list(args.batch_sizes, int)
+    thread_counts = parse_list(args.threads, int)
+    
+    print("Vehicle Detection Benchmark")
+    print("=" * 50)
+    
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__
+        },
+        'runs': []
+    }
+    
+    for (width, height), duration, density in itertools.product(resolutions, durations, densities):
+        video_path = workload_path(args.cache_dir, width, height, duration, density, args.fps)
+        
+        for backend, threads in itertools.product(backends, thread_counts):
+            apply_threads(threads)
+            model = load_backend(backend, density, args.stub_latency)
+            
+            for batch_size in batch_sizes:
+                samples, frames, seconds = run_case(video_path, model, batch_size, args.warmup)
+                run = {
+                    'workload': {'width': width, 'height': height, 'duration': duration,
+                                 'density': density, 'fps': args.fps},
+                    'config': {'backend': backend, 'batch_size': batch_size, 'threads': threads},
+                    'frames': frames,
+                    'fps': round(frames / seconds, 2) if seconds else 0.0,
+                    'stages': {name: summarize(samples[name]) for name in STAGES + ['total']}
+                }
+                report['runs'].append(run)
+                
+                total = run['stages']['total'] or {}
+                print(f"{describe(run)}: {run['fps']:.1f} FPS, "
+                      f"p50 {total.get('p50', 0):.1f} / p95 {total.get('p95', 0):.1f} / "
+                      f"p99 {total.get('p99', 0):.1f} ms per frame")
+                for name in STAGES:
+                    stage = run['stages'][name]
+                    if stage:
+                        print(f"    {name:<12} p50 {stage['p50']:8.2f}  p95 {stage['p95']:8.2f}  "
+                              f"p99 {stage['p99']:8.2f} ms")
+    
+    with open(args.output, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nResults written to {args.output}")
+    
+    if args.compare:
+        compare(report, args.compare)
+    
+    return 0
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,217 @@
 #!/usr/bin/env python3
 """
 Convert existing MP4 videos to AVI format for better compatibility
+
+Files are converted in a process pool. When ffmpeg is available and the video
+codec can live in an AVI container, the video and audio streams are copied
+without re-encoding; otherwise, or when the copy fails, the file is
+transcoded to XVID (with ffmpeg if present, else through OpenCV). Outputs
+newer than their input are skipped.
 """
 
-import cv2
-import os
+import argparse
 import glob
+import json
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Video codecs (ffprobe names) that AVI players handle, so a stream copy keeps
+# the compatibility the XVID re-encode was meant to give
+REMUX_CODECS = {'mpeg4', 'msmpeg4v2', 'msmpeg4v3', 'mjpeg'}
+
+def output_path_for(mp4_file):
+    """Return the AVI path a given MP4 converts to"""
+    return os.path.splitext(mp4_file)[0] + '_converted.avi'
+
+def is_up_to_date(src, dst):
+    """True when dst exists, is non-empty and is newer than src"""
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    return dst_stat.st_size > 0 and dst_stat.st_mtime >= os.stat(src).st_mtime
+
+def probe_video(path, ffprobe):
+    """Return (codec name, frame count) of the first video stream"""
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=codec_name,nb_frames', '-of', 'json', path],
+            capture_output=True, text=True, check=True
+        )
+        streams = json.loads(result.stdout).get('streams', [])
+        if not streams:
+            return None, None
+        frames = streams[0].get('nb_frames')
+        return streams[0].get('codec_name'), int(frames) if frames and frames.isdigit() else None
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None, None
 
-def convert_mp4_to_avi():
+def count_frames(path):
+    """Frame count from the container header (no decoding)"""
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    finally:
+        cap.release()
+
+def ffmpeg_convert(src, dst, ffmpeg, copy):
+    """Remux (copy=True) or transcode to XVID with ffmpeg
+    
+    Only video and audio are mapped: data, timecode and subtitle streams
+    have no place in an AVI. A transcode re-encodes audio to AC-3, which
+    AVI can hold and every ffmpeg build can encode.
+    """
+    if copy:
+        codec_args = ['-c', 'copy']
+    else:
+        codec_args = ['-c:v', 'mpeg4', '-vtag', 'XVID', '-q:v', '3', '-c:a', 'ac3']
+    subprocess.run(
+        [ffmpeg, '-v', 'error', '-y', '-i', src, '-map', '0:v:0', '-map', '0:a?']
+        + codec_args + ['-f', 'avi', dst],
+        check=True
+    )
+
+def opencv_convert(src, dst):
+    """Decode and re-encode every frame through cv2.VideoWriter"""
+    # OpenCV is only imported by workers that actually re-encode, and runs
+    # single-threaded since parallelism comes from the pool
+    import cv2
+    cv2.setNumThreads(1)
+    
+    cap = cv2.VideoCapture(src)
+    if not cap.isOpened():
+        raise IOError(f"Could not open {src}")
+    
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    out = cv2.VideoWriter(dst, fourcc, fps, (width, height))
+    
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        out.write(frame)
+        frame_count += 1
+    
+    cap.release()
+    out.release()
+    return frame_count
+
+def convert_file(mp4_file, force=False, reencode=False):
+    """Convert one file; runs inside a worker process"""
+    avi_file = output_path_for(mp4_file)
+    if os.path.abspath(avi_file) == os.path.abspath(mp4_file):
+        raise ValueError(f"Output would overwrite the input: {avi_file}")
+    size = os.path.getsize(mp4_file)
+    
+    if not force and is_up_to_date(mp4_file, avi_file):
+        return {'file': mp4_file, 'output': avi_file, 'method': 'skipped',
+                'frames': 0, 'bytes': 0, 'seconds': 0.0}
+    
+    # Write next to the target and rename, so an interrupted run never
+    # leaves a partial file that looks up to date
+    tmp_file = avi_file[:-len('.avi')] + '.part.avi'
+    ffmpeg = shutil.which('ffmpeg')
+    ffprobe = shutil.which('ffprobe')
+    
+    start = time.perf_counter()
+    try:
+        if ffmpeg:
+            codec, frames = probe_video(mp4_file, ffprobe) if ffprobe else (None, None)
+            copy = not reencode and codec in REMUX_CODECS
+            method = 'remux' if copy else 'ffmpeg-transcode'
+            try:
+                ffmpeg_convert(mp4_file, tmp_file, ffmpeg, copy)
+            except subprocess.CalledProcessError:
+                if not copy:
+                    raise
+                # e.g. an audio codec AVI can't hold; transcode instead
+                ffmpeg_convert(mp4_file, tmp_file, ffmpeg, copy=False)
+                method = 'ffmpeg-transcode'
+            if frames is None:
+                frames = count_frames(tmp_file)
+        else:
+            frames = opencv_convert(mp4_file, tmp_file)
+            method = 'opencv-transcode'
+        os.replace(tmp_file, avi_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    
+    return {'file': mp4_file, 'output': avi_file, 'method': method,
+            'frames': frames, 'bytes': size, 'seconds': time.perf_counter() - start}
+
+def convert_mp4_to_avi(pattern="output_video_*.mp4", jobs=None, force=False, reencode=False):
     """Convert all MP4 files in the directory to AVI format"""
     
     # Find all MP4 files
-    mp4_files = glob.glob("output_video_*.mp4")
+    mp4_files = sorted(glob.glob(pattern))
     
     if not mp4_files:
         print("No MP4 files found to convert.")
-        return
+        return []
     
-    print(f"Found {len(mp4_files)} MP4 files to convert:")
+    jobs = jobs or min(len(mp4_files), os.cpu_count() or 1)
+    print(f"Found {len(mp4_files)} MP4 files to convert ({jobs} workers):")
     for file in mp4_files:
         print(f"  - {file}")
+    if not shutil.which('ffmpeg'):
+        print("ffmpeg not found: falling back to OpenCV re-encoding for every file")
+    
+    results = []
+    wall_start = time.perf_counter()
     
-    for mp4_file in mp4_files:
-        print(f"\nConverting {mp4_file}...")
-        
-        # Open input video
-        cap = cv2.VideoCapture(mp4_file)
-        
-        if not cap.isOpened():
-            print(f"Error: Could not open {mp4_file}")
-            continue
-        
-        # Get video properties
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        print(f"  Properties: {width}x{height} @ {fps} FPS, {total_frames} frames")
-        
-        # Create output filename
-        avi_file = mp4_file.replace('.mp4', '_converted.avi')
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        out = cv2.VideoWriter(avi_file, fourcc, fps, (width, height))
-        
-        frame_count = 0
-        
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(convert_file, f, force, reencode): f for f in mp4_files}
+        for future in as_completed(futures):
+            mp4_file = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  ❌ {mp4_file}: {e}")
+                continue
             
-            out.write(frame)
-            frame_count += 1
+            results.append(result)
+            if result['method'] == 'skipped':
+                print(f"  ⏭️  {mp4_file}: up to date")
+                continue
             
-            # Progress update
-            if frame_count % 30 == 0:
-                progress = (frame_count / total_frames) * 100
-                print(f"  Progress: {progress:.1f}% ({frame_count}/{total_frames})")
-        
-        # Release everything
-        cap.release()
-        out.release()
-        
-        print(f"  ✅ Converted to: {avi_file}")
+            seconds = max(result['seconds'], 1e-9)
+            print(f"  ✅ {mp4_file} -> {result['output']} [{result['method']}] "
+                  f"{result['frames'] / seconds:.0f} frames/s, "
+                  f"{result['bytes'] / seconds / (1024*1024):.1f} MB/s")
     
-    print("\n🎉 All conversions complete!")
+    # Overall throughput is measured on the wall clock so it reflects the pool
+    wall = max(time.perf_counter() - wall_start, 1e-9)
+    converted = [r for r in results if r['method'] != 'skipped']
+    total_frames = sum(r['frames'] for r in converted)
+    total_bytes = sum(r['bytes'] for r in converted)
+    
+    print(f"\n🎉 Converted {len(converted)} file(s), skipped {len(results) - len(converted)} in {wall:.1f}s")
+    if converted:
+        print(f"Throughput: {total_frames / wall:.0f} frames/s, {total_bytes / wall / (1024*1024):.1f} MB/s")
     print("The AVI files should now work with all video players.")
+    
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert MP4 outputs to AVI")
+    parser.add_argument('pattern', nargs='?', default="output_video_*.mp4",
+                        help="Glob of files to convert (default: output_video_*.mp4)")
+    parser.add_argument('-j', '--jobs', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--force', action='store_true', help="Convert even if the output is up to date")
+    parser.add_argument('--reencode', action='store_true', help="Never remux; always re-encode to XVID")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    convert_mp4_to_avi()
+    args = parse_args()
+    convert_mp4_to_avi(args.pattern, jobs=args.jobs, force=args.force, reencode=args.reencode)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Persistent detection history backed by SQLite in WAL mode
+
+Requests hand detection counts to ``record()``, which only enqueues them; a
+background writer drains the queue, folds the counts into per-minute, hour
+and day buckets per vehicle class and source, and upserts each batch in one
+transaction. Only the rollups are stored, so a range query over weeks of data
+reads a few hundred rows from the primary-key index.
+
+Rows with class ``'all'`` carry the total number of detections in the bucket
+and the number of frames/images that were run through the model.
+"""
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import metrics
+
+DB_PATH = os.environ.get('DETECTION_DB', 'detections.db')
+
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+# How long each rollup is kept, in seconds (None keeps forever)
+RETENTION = {'minute': 14 * 86400, 'hour': 400 * 86400, 'day': None}
+ALL_CLASSES = 'all'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    class TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    frames INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (resolution, bucket, source, class)
+) WITHOUT ROWID
+"""
+
+UPSERT = """
+INSERT INTO rollups (resolution, bucket, source, class, count, frames)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, bucket, source, class)
+DO UPDATE SET count = count + excluded.count, frames = frames + excluded.frames
+"""
+
+def connect(path=None):
+    conn = sqlite3.connect(path or DB_PATH, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(SCHEMA)
+    return conn
+
+def pick_resolution(start, end):
+    """Coarsest-needed resolution that still gives a useful number of points"""
+    span = end - start
+    if span <= 6 * 3600:
+        return 'minute'
+    if span <= 14 * 86400:
+        return 'hour'
+    return 'day'
+
+class DetectionStore:
+    def __init__(self, path=None, batch_size=500, flush_interval=1.0, max_queue=10000):
+        self.path = path or DB_PATH
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._last_prune = 0
+        connect(self.path).close()
+        self._writer = threading.Thread(target=self._run, name='detection-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+    
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+    
+    def record(self, vehicle_count, source='image', timestamp=None):
+        """Queue one inference result ({class: count}) for writing; never blocks"""
+        try:
+            self._queue.put_nowait((timestamp or time.time(), source, dict(vehicle_count)))
+        except queue.Full:
+            DROPPED.inc()
+            return
+        with self._flushed:
+            self._pending += 1
+    
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written"""
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+    
+    def _run(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(conn, batch)
+            except sqlite3.Error as e:
+                print(f"Warning: dropped {len(batch)} detection records: {e}")
+                DROPPED.inc(len(batch))
+            with self._flushed:
+                self._pending -= len(batch)
+                self._flushed.notify_all()
+    
+    def _write(self, conn, batch):
+        # Fold the batch into buckets first so each row is upserted once
+        totals = defaultdict(lambda: [0, 0])
+        for timestamp, source, vehicle_count in batch:
+            for seconds in RESOLUTIONS.values():
+                bucket = int(timestamp // seconds * seconds)
+                row = totals[(seconds, bucket, source, ALL_CLASSES)]
+                row[0] += sum(vehicle_count.values())
+                row[1] += 1
+                for vehicle, count in vehicle_count.items():
+                    totals[(seconds, bucket, source, vehicle)][0] += count
+        
+        start = time.perf_counter()
+        with conn:
+            conn.executemany(UPSERT, [key + tuple(value) for key, value in totals.items()])
+        WRITE_SECONDS.observe(time.perf_counter() - start)
+        WRITTEN.inc(len(batch))
+        
+        if time.time() - self._last_prune > 3600:
+            self._prune(conn)
+    
+    def _prune(self, conn):
+        self._last_prune = time.time()
+        with conn:
+            for name, keep in RETENTION.items():
+                if keep is not None:
+                    conn.execute('DELETE FROM rollups WHERE resolution = ? AND bucket < ?',
+                                 (RESOLUTIONS[name], int(time.time() - keep)))
+    
+    def history(self, start, end, resolution=None, source=None):
+        """Buckets in [start, end) as a list of {'bucket', 'detections', 'frames', 'vehicles'}"""
+        resolution = resolution or pick_resolution(start, end)
+        seconds = RESOLUTIONS[resolution]
+        query = ('SELECT bucket, class, SUM(count), SUM(frames) FROM rollups '
+                 'WHERE resolution = ? AND bucket >= ? AND bucket < ?')
+        params = [seconds, int(start // seconds * seconds), int(end)]
+        if source:
+            query += ' AND source = ?'
+            params.append(source)
+        query += ' GROUP BY bucket, class ORDER BY bucket'
+        
+        buckets = {}
+        for bucket, vehicle, count, frames in self._reader().execute(query, params):
+            entry = buckets.setdefault(bucket, {'bucket': bucket, 'detections': 0, 'frames': 0, 'vehicles': {}})
+            if vehicle == ALL_CLASSES:
+                entry['detections'] = count
+                entry['frames'] = frames
+            else:
+                entry['vehicles'][vehicle] = count
+        return list(buckets.values())
+    
+    def totals(self, source=None):
+        """All-time ({class: count}, total detections) from the daily rollups"""
+        query = 'SELECT class, SUM(count) FROM rollups WHERE resolution = ?'
+        params = [RESOLUTIONS['day']]
+        if source:
+            query += ' AND source = ?'
+            params.append(source)
+        counts = dict(self._reader().execute(query + ' GROUP BY class', params))
+        return counts, counts.pop(ALL_CLASSES, 0)
+
+WRITTEN = metrics.counter('vehicle_history_records_written', 'Detection records persisted to the history store')
+DROPPED = metrics.counter('vehicle_history_records_dropped', 'Detection records dropped because the writer fell behind or failed')
+WRITE_SECONDS = metrics.histogram('vehicle_history_write_seconds', 'Time to upsert one batch of detection rollups')
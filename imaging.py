@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Image helpers shared by the upload paths in app.py
+
+Reads image dimensions from the file header without decoding, so memory can
+be budgeted before a large upload is decoded, decodes large JPEGs straight at
+a reduced scale, and shrinks oversized frames for inference while keeping box
+coordinates in the original image space.
+"""
+
+import math
+import struct
+
+import cv2
+import numpy as np
+
+# libjpeg can scale by 1/2, 1/4 or 1/8 while decoding, in the DCT domain,
+# skipping most of the IDCT and colour conversion work
+REDUCED_DECODE_MODES = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                        2: cv2.IMREAD_REDUCED_COLOR_2}
+
+def image_size(data):
+    """Return (width, height) from a JPEG/PNG/GIF/BMP header, or None"""
+    data = bytes(data[:65536]) if not isinstance(data, bytes) else data
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return width, height
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', data[6:10])
+        return width, height
+    if data[:2] == b'BM' and len(data) >= 26:
+        width, height = struct.unpack('<ii', data[18:26])
+        return width, abs(height)
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_size(data)
+    return None
+
+def _jpeg_size(data):
+    # Walk the marker segments up to the first start-of-frame
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            offset += 1
+            continue
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+def reduced_decode_factor(data, min_side):
+    """Largest JPEG decode reduction (1, 2, 4 or 8) keeping the longer side >= min_side"""
+    if not min_side or data[:2] != b'\xff\xd8':
+        return 1
+    size = image_size(data)
+    if size is None:
+        return 1
+    for factor in sorted(REDUCED_DECODE_MODES, reverse=True):
+        if math.ceil(max(size) / factor) >= min_side:
+            return factor
+    return 1
+
+def decoded_size(data, min_side=None):
+    """(width, height) decode_image will produce, from the header alone, or None"""
+    size = image_size(data)
+    if size is None:
+        return None
+    factor = reduced_decode_factor(data, min_side)
+    return math.ceil(size[0] / factor), math.ceil(size[1] / factor)
+
+def decode_image(data, min_side=None):
+    """Decode encoded image bytes, at a reduced scale when min_side allows it
+    
+    A JPEG whose longer side is at least twice ``min_side`` is decoded at 1/2,
+    1/4 or 1/8 size, whichever still covers ``min_side``. Returns (image,
+    scale) with scale = decoded size / original size, like
+    downscale_for_inference; image is None if the data can't be decoded.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    factor = reduced_decode_factor(data, min_side)
+    if factor > 1:
+        image = cv2.imdecode(buffer, REDUCED_DECODE_MODES[factor])
+        if image is not None:
+            # Scaled DCT maps each 8x8 block to 8/factor pixels, so original
+            # coordinates are exactly decoded ones times factor (a partial
+            # last block only rounds the decoded size up)
+            return image, 1.0 / factor
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1.0
+
+def downscale_for_inference(image, max_side, buffer=None):
+    """Shrink image so its longer side is at most max_side.
+    
+    Returns (image, scale) where scale = new size / original size. Images that
+    already fit are returned as-is with scale 1.0. ``buffer`` is reused as the
+    output array when it has the right shape (e.g. successive video frames).
+    """
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not max_side or longest <= max_side:
+        return image, 1.0
+    
+    scale = max_side / float(longest)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if buffer is not None and buffer.shape[:2] == (size[1], size[0]) and buffer.dtype == image.dtype:
+        resized = cv2.resize(image, size, dst=buffer, interpolation=cv2.INTER_AREA)
+    else:
+        resized = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return resized, scale
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Report module import (startup) time for the app and CLI tools
+
+Each module is imported in a fresh interpreter with ``python -X importtime``
+so results aren't skewed by modules already loaded here. Prints the total and
+the slowest top-level packages, and exits non-zero when a module exceeds the
+startup budget, so it can gate CI:
+
+    python import_report.py app play_video convert_videos --budget-ms 800
+"""
+
+import argparse
+import subprocess
+import sys
+
+DEFAULT_MODULES = ['app', 'play_video', 'convert_videos', 'realtime_detection']
+
+def measure(module):
+    """Return (total_ms, {top-level package: cumulative_ms}) for importing module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'import failed')
+    
+    packages = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        try:
+            _, cumulative, raw_name = line[len('import time:'):].split('|')
+            cumulative_us = int(cumulative)
+        except ValueError:
+            continue  # header line
+        # Nesting is shown by two spaces per level; level 1 is what the
+        # module itself imports
+        name = raw_name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        name = name.strip()
+        if depth == 0 and name == module:
+            total_us = cumulative_us
+        elif depth == 1:
+            top = name.split('.')[0]
+            packages[top] = packages.get(top, 0) + cumulative_us
+    return total_us / 1000.0, {k: v / 1000.0 for k, v in packages.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time of the app and CLI tools")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument('--top', type=int, default=8, help="Slowest packages to list per module")
+    parser.add_argument('--budget-ms', type=float, help="Fail if any module takes longer to import")
+    args = parser.parse_args(argv)
+    
+    over_budget = []
+    for module in args.modules:
+        try:
+            total_ms, packages = measure(module)
+        except RuntimeError as e:
+            print(f"{module}: [FAIL] {e}")
+            over_budget.append(module)
+            continue
+        
+        status = ''
+        if args.budget_ms is not None:
+            status = ' [OK]' if total_ms <= args.budget_ms else f' [OVER BUDGET {args.budget_ms:.0f} ms]'
+            if total_ms > args.budget_ms:
+                over_budget.append(module)
+        print(f"{module}: {total_ms:.0f} ms{status}")
+        for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            if name != module:
+                print(f"    {name:<24} {ms:8.1f} ms")
+    
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for the Flask service in app.py
+
+Drives ``/upload`` with a mix of images and short videos at a fixed
+concurrency (closed loop) or a target arrival rate (open loop), while
+dashboard clients poll ``/stats`` and ``/history`` on the same schedule as
+index.html. Reports throughput, latency percentiles and error rates per
+endpoint, server CPU/memory, and whether the server's ``total_detections``
+counter matches what the responses returned (lost updates on the shared
+``detection_stats`` show up as drift).
+
+    python load_test.py --spawn --stub --concurrency 8 --duration 30
+    python load_test.py --url http://localhost:5000 --rate 5 --server-pid 1234
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from create_test_video import create_test_video, render_frame
+
+# Poll intervals used by index.html
+STATS_INTERVAL = 5.0
+HISTORY_INTERVAL = 10.0
+
+def build_payloads(work_dir, image_size, video_seconds):
+    """Encode one synthetic JPEG and one short MP4 to upload repeatedly
+    
+    Each video upload is made unique by unique_video(), so the server's
+    output store can't answer it from cache.
+    """
+    width, height = image_size
+    frame = render_frame(42, width, height, density=2)
+    _, jpeg = cv2.imencode('.jpg', frame)
+    
+    video_path = os.path.join(work_dir, 'load_test_clip.mp4')
+    create_test_video(video_path, width=320, height=240, fps=15,
+                      duration=video_seconds, verbose=False)
+    with open(video_path, 'rb') as fh:
+        video = fh.read()
+    
+    return {
+        'image': ('load_test.jpg', 'image/jpeg', jpeg.tobytes()),
+        'video': ('load_test.mp4', 'video/mp4', video)
+    }
+
+def unique_video(data):
+    """MP4 bytes with a random 'free' box appended, so the content hash differs per upload"""
+    padding = uuid.uuid4().bytes
+    return data + struct.pack('>I', 8 + len(padding)) + b'free' + padding
+
+def encode_multipart(filename, content_type, data):
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')
+    tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return head + data + tail, f'multipart/form-data; boundary={boundary}'
+
+class Recorder:
+    """Thread-safe collection of request outcomes"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.detections_returned = 0
+        self.cached = 0
+    
+    def record(self, name, status, latency, error=None, detections=0, cached=False):
+        with self.lock:
+            self.latencies[name].append(latency)
+            self.statuses[name][status] += 1
+            if error:
+                self.errors[name][error[:120]] += 1
+            # A cached result doesn't touch the server's counters
+            if cached:
+                self.cached += 1
+            else:
+                self.detections_returned += detections
+
+def request(url, data=None, content_type=None, timeout=300):
+    """Issue one request; returns (status, body bytes, error message)"""
+    req = urllib.request.Request(url, data=data)
+    if content_type:
+        req.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read(), None
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        try:
+            message = json.loads(body).get('error', '')
+        except ValueError:
+            message = body[:120].decode('utf-8', 'replace')
+        return e.code, body, f"HTTP {e.code}: {message}"
+    except Exception as e:
+        return 0, b'', f"{type(e).__name__}: {e}"
+
+def upload(base_url, payloads, kind, recorder, scheduled=None):
+    """Upload one image or video; latency counts from the scheduled start"""
+    filename, content_type, data = payloads[kind]
+    if kind == 'video':
+        data = unique_video(data)
+    body, multipart_type = encode_multipart(filename, content_type, data)
+    start = scheduled if scheduled is not None else time.perf_counter()
+    status, response, error = request(f"{base_url}/upload", body, multipart_type)
+    latency = time.perf_counter() - start
+    
+    detections = 0
+    cached = False
+    if status == 200:
+        try:
+            result = json.loads(response)
+            cached = result.get('cached', False)
+            if kind == 'image':
+                detections = len(result.get('detections', []))
+            else:
+                detections = result.get('stats', {}).get('total_detections', 0)
+        except ValueError:
+            error = "Invalid JSON response"
+    recorder.record(f"upload:{kind}", status, latency, error, detections, cached)
+
+def dashboard_client(base_url, recorder, stop):
+    """Poll /stats and /history like index.html does"""
+    next_stats = time.perf_counter() + random.uniform(0, STATS_INTERVAL)
+    next_history = time.perf_counter() + random.uniform(0, HISTORY_INTERVAL)
+    while not stop.is_set():
+        now = time.perf_counter()
+        for name, due in (('stats', next_stats), ('history', next_history)):
+            if now >= due:
+                start = time.perf_counter()
+                status, _, error = request(f"{base_url}/{name}", timeout=30)
+                recorder.record(name, status, time.perf_counter() - start, error)
+        if now >= next_stats:
+            next_stats += STATS_INTERVAL
+        if now >= next_history:
+            next_history += HISTORY_INTERVAL
+        stop.wait(max(0.05, min(next_stats, next_history) - time.perf_counter()))
+
+class ResourceSampler(threading.Thread):
+    """Sample CPU, RSS and thread count of the server process"""
+    
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        try:
+            import psutil
+            self.process = psutil.Process(pid)
+            self.process.cpu_percent(None)
+        except Exception as e:
+            print(f"Warning: server resource sampling disabled ({e})")
+            self.process = None
+    
+    def run(self):
+        while self.process is not None and not self.stop_event.wait(self.interval):
+            try:
+                with self.process.oneshot():
+                    self.samples.append({
+                        'cpu_percent': self.process.cpu_percent(None),
+                        'rss_mb': self.process.memory_info().rss / (1024 * 1024),
+                        'threads': self.process.num_threads()
+                    })
+            except Exception:
+                break
+    
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = [s['cpu_percent'] for s in self.samples]
+        rss = [s['rss_mb'] for s in self.samples]
+        return {
+            'cpu_percent_avg': round(sum(cpu) / len(cpu), 1),
+            'cpu_percent_max': round(max(cpu), 1),
+            'rss_mb_start': round(rss[0], 1),
+            'rss_mb_max': round(max(rss), 1),
+            'threads_max': max(s['threads'] for s in self.samples)
+        }
+
+def spawn_server(port, stub, stub_latency, work_dir):
+    """Start app.py in a subprocess (threaded server, no reloader)"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__)) + os.pathsep + env.get('PYTHONPATH', '')
+    if stub:
+        env['VEHICLE_MODEL'] = 'stub'
+        env['STUB_LATENCY_MS'] = str(stub_latency)
+    code = ("import app; app.setup(); app.initialize_model(); "
+            f"app.app.run(host='127.0.0.1', port={port}, threaded=True, use_reloader=False)")
+    # Run from a scratch directory so temp and output videos don't pile up
+    return subprocess.Popen([sys.executable, '-c', code], cwd=work_dir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_until_ready(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, _, _ = request(f"{base_url}/stats", timeout=2)
+        if status == 200:
+            return True
+        time.sleep(0.5)
+    return False
+
+def fetch_total_detections(base_url):
+    status, body, _ = request(f"{base_url}/stats", timeout=30)
+    if status != 200:
+        return None
+    return json.loads(body).get('total_detections')
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64) * 1000.0
+    return {
+        'p50': round(float(np.percentile(values, 50)), 1),
+        'p95': round(float(np.percentile(values, 95)), 1),
+        'p99': round(float(np.percentile(values, 99)), 1),
+        'max': round(float(values.max()), 1)
+    }
+
+def run_load(base_url, payloads, args, recorder):
+    """Generate upload traffic until the duration elapses"""
+    stop = threading.Event()
+    pollers = [threading.Thread(target=dashboard_client, args=(base_url, recorder, stop), daemon=True)
+               for _ in range(args.dashboards)]
+    for poller in pollers:
+        poller.start()
+    
+    def pick_kind():
+        return 'video' if random.random() < args.video_ratio else 'image'
+    
+    deadline = time.perf_counter() + args.duration
+    
+    if args.rate:
+        # Open loop: arrivals follow a Poisson process regardless of how
+        # fast the server answers, so queueing shows up in the latencies
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            next_arrival = time.perf_counter()
+            while next_arrival < deadline:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(upload, base_url, payloads, pick_kind(), recorder, next_arrival)
+                next_arrival += random.expovariate(args.rate)
+    else:
+        def worker():
+            while time.perf_counter() < deadline:
+                upload(base_url, payloads, pick_kind(), recorder)
+        
+        workers = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    
+    stop.set()
+    for poller in pollers:
+        poller.join()
+
+def build_report(recorder, elapsed, resources, stats_drift):
+    endpoints = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        total = len(latencies)
+        ok = recorder.statuses[name].get(200, 0)
+        endpoints[name] = {
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2),
+            'error_rate': round((total - ok) / total, 4) if total else 0.0,
+            'status_codes': {str(k): v for k, v in recorder.statuses[name].items()},
+            'latency_ms': percentiles(latencies),
+            'errors': dict(recorder.errors[name])
+        }
+    return {'elapsed_seconds': round(elapsed, 1), 'endpoints': endpoints, 'cached_responses': recorder.cached,
+            'server': resources, 'stats_drift': stats_drift}
+
+def print_report(report):
+    print(f"\nLoad test finished in {report['elapsed_seconds']}s")
+    print(f"{'endpoint':<14}{'reqs':>7}{'rps':>9}{'err%':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, ep in report['endpoints'].items():
+        lat = ep['latency_ms']
+        print(f"{name:<14}{ep['requests']:>7}{ep['throughput_rps']:>9.2f}{ep['error_rate'] * 100:>7.1f}%"
+              f"{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}{lat['max']:>9.1f}")
+        for message, count in ep['errors'].items():
+            print(f"    {count} x {message}")
+    if report['cached_responses']:
+        print(f"{report['cached_responses']} responses were served from the output cache")
+    
+    server = report['server']
+    if server:
+        print(f"\nServer: CPU avg {server['cpu_percent_avg']}% (max {server['cpu_percent_max']}%), "
+              f"RSS {server['rss_mb_start']} -> max {server['rss_mb_max']} MB, "
+              f"threads max {server['threads_max']}")
+    
+    drift = report['stats_drift']
+    if drift is not None:
+        if drift['difference'] == 0:
+            print("Stats consistency: OK (server total_detections matches responses)")
+        else:
+            print(f"Stats consistency: DRIFT of {drift['difference']} detections "
+                  f"(server counted {drift['server_delta']}, responses returned {drift['returned']})")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the vehicle detection web service")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', default='http://127.0.0.1:5000', help="Base URL of a running server")
+    target.add_argument('--spawn', action='store_true', help="Start a local app.py server for the run")
+    parser.add_argument('--port', type=int, default=5055, help="Port for --spawn")
+    parser.add_argument('--stub', action='store_true', help="With --spawn, use the stub detector")
+    parser.add_argument('--stub-latency', type=float, default=20.0, help="Stub inference time per call in ms")
+    parser.add_argument('--server-pid', type=int, help="PID of an already running server to sample")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrent upload clients / max in flight")
+    parser.add_argument('--rate', type=float, help="Open-loop arrival rate in uploads/s")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of upload traffic")
+    parser.add_argument('--video-ratio', type=float, default=0.1, help="Fraction of uploads that are videos")
+    parser.add_argument('--video-seconds', type=int, default=1, help="Length of the uploaded test video")
+    parser.add_argument('--image-size', default='1280x720', help="Uploaded image size WxH")
+    parser.add_argument('--dashboards', type=int, default=2, help="Dashboard clients polling /stats and /history")
+    parser.add_argument('--output', help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    server = None
+    try:
+        payloads = build_payloads(work_dir, (width, height), args.video_seconds)
+        
+        base_url = args.url.rstrip('/')
+        pid = args.server_pid
+        if args.spawn:
+            base_url = f"http://127.0.0.1:{args.port}"
+            server = spawn_server(args.port, args.stub, args.stub_latency, work_dir)
+            pid = server.pid
+        
+        print(f"Waiting for {base_url} ...")
+        if not wait_until_ready(base_url):
+            print("Error: server did not become ready")
+            return 1
+        
+        sampler = ResourceSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+        
+        mode = f"open loop at {args.rate}/s" if args.rate else "closed loop"
+        print(f"Running {args.duration:.0f}s, {mode}, concurrency {args.concurrency}, "
+              f"{args.video_ratio:.0%} videos, {args.dashboards} dashboard clients")
+        
+        recorder = Recorder()
+        before = fetch_total_detections(base_url)
+        start = time.perf_counter()
+        run_load(base_url, payloads, args, recorder)
+        elapsed = time.perf_counter() - start
+        after = fetch_total_detections(base_url)
+        
+        resources = None
+        if sampler:
+            sampler.stop_event.set()
+            sampler.join()
+            resources = sampler.summary()
+        
+        stats_drift = None
+        if before is not None and after is not None:
+            server_delta = after - before
+            stats_drift = {'server_delta': server_delta, 'returned': recorder.detections_returned,
+                           'difference': server_delta - recorder.detections_returned}
+        
+        report = build_report(recorder, elapsed, resources, stats_drift)
+        print_report(report)
+        
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, indent=2)
+            print(f"\nReport written to {args.output}")
+        return 0
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus-style metrics for the vehicle detection service
+
+Counters, gauges and histograms are kept in-process and rendered in the
+Prometheus text exposition format by ``render()``, which app.py serves on
+``/metrics``. Everything is thread-safe so Flask request threads can record
+concurrently.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond drawing up to multi-second inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = 'untyped'
+    
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._function = function
+        self._lock = threading.Lock()
+        self._values = {}
+    
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+    
+    def _items(self):
+        """Sorted (label values, value) pairs, read from the callback if there is one"""
+        if self._function is not None:
+            # Callbacks return {label tuple: value} (or a bare number)
+            values = self._function()
+            return sorted(values.items()) if isinstance(values, dict) else [((), values)]
+        with self._lock:
+            return sorted(self._values.items())
+
+class Counter(_Metric):
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+    
+    def samples(self):
+        return [f"{self.name}_total{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                for k, v in self._items() if v is not None]
+
+class Gauge(_Metric):
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+    
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                for k, v in self._items() if v is not None]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the ``with`` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def samples(self):
+        with self._lock:
+            items = sorted((k, dict(v, counts=list(v['counts']))) for k, v in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name, documentation, labelnames=(), function=None):
+    return REGISTRY.register(Counter(name, documentation, labelnames, function))
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return REGISTRY.register(Gauge(name, documentation, labelnames, function))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+def render():
+    return REGISTRY.render()
+
+def _process_memory():
+    """Resident set size of this process in bytes"""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _process_cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+# Pipeline metrics shared by app.py and its helpers
+STAGE_SECONDS = histogram('vehicle_stage_seconds',
+                          'Time spent in each processing stage',
+                          ['stage'])
+REQUESTS = counter('vehicle_requests',
+                   'HTTP requests by type and status',
+                   ['type', 'status'])
+MODEL_QUEUE_DEPTH = gauge('vehicle_model_queue_depth',
+                          'Inference calls waiting for or running on the model')
+VIDEO_JOB_FPS = histogram('vehicle_video_job_fps',
+                          'Processing rate of each video job in frames per second',
+                          buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 240))
+CACHE_LOOKUPS = counter('vehicle_cache_lookups',
+                        'Cache lookups by cache and result',
+                        ['cache', 'result'])
+
+def _cache_hit_ratios():
+    with CACHE_LOOKUPS._lock:
+        values = dict(CACHE_LOOKUPS._values)
+    ratios = {}
+    for cache in {key[0] for key in values}:
+        hits = values.get((cache, 'hit'), 0)
+        total = hits + values.get((cache, 'miss'), 0)
+        ratios[(cache,)] = hits / total if total else None
+    return ratios
+
+CACHE_HIT_RATIO = gauge('vehicle_cache_hit_ratio',
+                        'Fraction of cache lookups that were hits',
+                        ['cache'], function=_cache_hit_ratios)
+PROCESS_MEMORY = gauge('process_resident_memory_bytes',
+                       'Resident memory size in bytes', function=_process_memory)
+PROCESS_CPU = counter('process_cpu_seconds',
+                      'Total user and system CPU time in seconds', function=_process_cpu_seconds)
+
+def record_cache(cache, hit):
+    """Count a cache lookup; the hit ratio gauge is derived from these"""
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
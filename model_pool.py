@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Pool of detector instances for concurrent inference in one process
+
+A YOLO predictor keeps per-call state, so one instance must not run on two
+threads at once. The pool holds ``size`` independent instances; a request
+checks one out (waiting up to a timeout), runs inference and returns it. Each
+checkout sets the calling thread's torch intra-op thread count to the
+instance's share of the CPU budget, so ``size`` concurrent inferences use the
+cores without oversubscribing them.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import admission
+import metrics
+
+class PoolTimeout(admission.Rejected):
+    """No instance became free within the checkout timeout"""
+    
+    def __init__(self, timeout):
+        super().__init__(f"All model instances busy for {timeout:g}s, retry later", retry_after=1)
+
+# utilization() covers roughly this many seconds, whoever asks and how often
+UTILIZATION_WINDOW = 60.0
+
+class ModelPool:
+    def __init__(self, factory, size, threads_per_instance=None):
+        self.size = size
+        self.threads_per_instance = threads_per_instance
+        self._idle = queue.LifoQueue()  # most recently used first, its caches are warm
+        self._lock = threading.Lock()
+        self._thread_budget = threading.local()
+        self.in_use = 0
+        self.waiting = 0
+        self.busy_seconds = 0.0
+        # (time, busy_seconds) marks a few per window apart, oldest first
+        self._marks = deque([(time.monotonic(), 0.0)])
+        for _ in range(size):
+            self._idle.put(factory())
+    
+    def _apply_thread_budget(self):
+        # torch's intra-op setting is per OS thread under OpenMP, so it only
+        # needs setting once for each request thread
+        if not self.threads_per_instance or getattr(self._thread_budget, 'threads', None) == self.threads_per_instance:
+            return
+        try:
+            import torch
+            torch.set_num_threads(self.threads_per_instance)
+        except ImportError:
+            pass
+        self._thread_budget.threads = self.threads_per_instance
+    
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Borrow an instance for the ``with`` block; raises PoolTimeout"""
+        with self._lock:
+            self.waiting += 1
+        start = time.perf_counter()
+        try:
+            instance = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            CHECKOUT_TIMEOUTS.inc()
+            raise PoolTimeout(timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        CHECKOUT_WAIT_SECONDS.observe(time.perf_counter() - start)
+        
+        with self._lock:
+            self.in_use += 1
+        self._apply_thread_budget()
+        busy_start = time.perf_counter()
+        try:
+            yield instance
+        finally:
+            held = time.perf_counter() - busy_start
+            with self._lock:
+                self.in_use -= 1
+                self.busy_seconds += held
+            BUSY_SECONDS.inc(held)
+            self._idle.put(instance)
+    
+    def utilization(self):
+        """Share of instance time spent busy over the last UTILIZATION_WINDOW seconds (0..1)
+        
+        A read records a (time, busy seconds) mark at most once per quarter
+        window and drops marks older than the window, so the value doesn't
+        depend on how many scrapers read it or how often.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._marks[-1][0] >= UTILIZATION_WINDOW / 4:
+                self._marks.append((now, self.busy_seconds))
+            while len(self._marks) > 1 and now - self._marks[1][0] >= UTILIZATION_WINDOW:
+                self._marks.popleft()
+            since, busy_then = self._marks[0]
+            elapsed = now - since
+            busy = self.busy_seconds - busy_then
+        if elapsed <= 0:
+            return 0.0
+        return min(busy / (elapsed * self.size), 1.0)
+    
+    def stats(self):
+        """Pool size, occupancy and busy time for /stats"""
+        with self._lock:
+            return {'size': self.size, 'in_use': self.in_use, 'waiting': self.waiting,
+                    'threads_per_instance': self.threads_per_instance,
+                    'busy_seconds': round(self.busy_seconds, 3)}
+
+CHECKOUT_WAIT_SECONDS = metrics.histogram('vehicle_model_checkout_wait_seconds',
+                                          'Time spent waiting for a free model instance')
+BUSY_SECONDS = metrics.counter('vehicle_model_busy_seconds',
+                               'Total time model instances spent checked out')
+CHECKOUT_TIMEOUTS = metrics.counter('vehicle_model_checkout_timeouts',
+                                    'Inference calls that gave up waiting for a model instance')
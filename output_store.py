@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store for annotated output videos
+
+Outputs are keyed by the SHA-256 of the uploaded input plus a digest of the
+processing settings, so uploading the same video twice with the same model
+returns the existing artifact instead of reprocessing it. ``index.json`` in
+the store directory maps keys and filenames to entries so ``/download`` never
+scans the directory. When the store grows past its quota, the outputs that
+were used least recently are evicted first.
+
+Access times are only updated in memory on each download or cache hit and
+written to the index later, by a timer, on the next put and at exit, so a
+download never rewrites the index.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import metrics
+
+INDEX_FILE = 'index.json'
+# Seconds between an access-time update and the index write that saves it
+FLUSH_SECONDS = 30.0
+# Partial outputs older than this were left by an interrupted render
+STALE_PART_SECONDS = 3600
+
+def settings_digest(settings):
+    """Stable short digest of a JSON-serialisable settings dict"""
+    encoded = json.dumps(settings, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+class OutputStore:
+    def __init__(self, root, quota_bytes):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flush_timer = None
+        os.makedirs(root, exist_ok=True)
+        self._entries = self._load_index()
+        self._by_filename = {entry['filename']: key for key, entry in self._entries.items()}
+        self._remove_stale_parts()
+        atexit.register(self.flush)
+    
+    def _index_path(self):
+        return os.path.join(self.root, INDEX_FILE)
+    
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as fh:
+                entries = json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Warning: rebuilding output index: {e}")
+            return {}
+        # Drop entries whose files were removed by hand
+        return {key: entry for key, entry in entries.items()
+                if os.path.exists(os.path.join(self.root, entry['filename']))}
+    
+    def _save_index(self):
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(self._entries, fh)
+        os.replace(tmp_path, self._index_path())
+        self._dirty = False
+    
+    def _remove_stale_parts(self):
+        cutoff = time.time() - STALE_PART_SECONDS
+        for entry in os.listdir(self.root):
+            if '.part.' not in entry:
+                continue
+            path = os.path.join(self.root, entry)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+    
+    def _touch(self, entry):
+        # Called with the lock held; the index is written later by flush()
+        entry['last_access'] = time.time()
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(FLUSH_SECONDS, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def flush(self):
+        """Write access times updated since the last index write"""
+        with self._lock:
+            self._flush_timer = None
+            if self._dirty:
+                self._save_index()
+    
+    def key(self, input_digest, settings):
+        """Store key for an input hash processed with the given settings"""
+        return f"{input_digest[:32]}-{settings_digest(settings)}"
+    
+    def filename_for(self, key, extension='.avi'):
+        return f"output_video_{key}{extension}"
+    
+    def temp_path(self, key, extension='.avi'):
+        """Where to write an output before it is committed with put()"""
+        # Unique so two identical uploads processed at once don't share a file
+        return os.path.join(self.root, f"{key}.{uuid.uuid4().hex[:8]}.part{extension}")
+    
+    def get(self, key):
+        """Entry for key, or None, marking it recently used; counts a hit or miss in /metrics"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(os.path.join(self.root, entry['filename'])):
+                self._forget(key)
+                entry = None
+            if entry is not None:
+                self._touch(entry)
+        metrics.record_cache('outputs', entry is not None)
+        return dict(entry) if entry is not None else None
+    
+    def put(self, key, temp_path, result, extension='.avi'):
+        """Move a finished output into the store and evict over quota; returns the entry"""
+        filename = self.filename_for(key, extension)
+        path = os.path.join(self.root, filename)
+        os.replace(temp_path, path)
+        now = time.time()
+        entry = {'filename': filename, 'size': os.path.getsize(path),
+                 'created': now, 'last_access': now, 'result': result}
+        with self._lock:
+            self._entries[key] = entry
+            self._by_filename[filename] = key
+            self._evict(keep=key)
+            self._save_index()
+        return dict(entry)
+    
+    def lookup(self, filename):
+        """Path of a stored output by filename, marking it recently used"""
+        with self._lock:
+            key = self._by_filename.get(filename)
+            if key is None:
+                return None
+            path = os.path.join(self.root, filename)
+            if not os.path.exists(path):
+                self._forget(key)
+                return None
+            self._touch(self._entries[key])
+            return path
+    
+    def usage(self):
+        """Entry count, bytes stored and the quota"""
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': sum(entry['size'] for entry in self._entries.values()),
+                    'quota_bytes': self.quota_bytes}
+    
+    def _forget(self, key):
+        entry = self._entries.pop(key)
+        self._by_filename.pop(entry['filename'], None)
+        self._dirty = True
+    
+    def _evict(self, keep=None):
+        total = sum(entry['size'] for entry in self._entries.values())
+        by_age = sorted(self._entries.items(), key=lambda item: item[1]['last_access'])
+        for key, entry in by_age:
+            if total <= self.quota_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root, entry['filename']))
+            except OSError:
+                pass
+            total -= entry['size']
+            self._forget(key)
+            EVICTIONS.inc()
+
+EVICTIONS = metrics.counter('vehicle_output_evictions', 'Stored outputs evicted to stay under the disk quota')
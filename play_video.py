@@ -1,13 +1,192 @@
 #!/usr/bin/env python3
 """
 Simple video player to view the processed videos
+
+Frames are decoded ahead on a background thread and presented against a wall
+clock, so playback runs at the real frame rate and drops frames instead of
+drifting when decoding falls behind. Detections can be drawn live from a
+sidecar file (``<video>.detections.jsonl``) instead of being burned into a
+re-encoded copy of the video.
 """
 
-import cv2
+import argparse
+import bisect
+import json
 import os
+import queue
 import sys
+import threading
+import time
+
+import cv2
+
+from detection_batch import DetectionBatch
+
+SIDECAR_SUFFIX = '.detections.jsonl'
+
+# Colors per vehicle type (BGR), same palette as realtime_detection.py
+OVERLAY_COLORS = {
+    'car': (0, 255, 0),
+    'motorcycle': (0, 255, 255),
+    'bus': (255, 0, 0),
+    'truck': (255, 0, 255)
+}
+
+SEEK_STEP_SECONDS = 5.0
+
+def sidecar_path_for(video_path):
+    """Return the default sidecar path for a video file"""
+    return os.path.splitext(video_path)[0] + SIDECAR_SUFFIX
+
+class DetectionSidecar:
+    """Per-frame detections loaded from a JSON Lines sidecar file.
+    
+    Each line is ``{"frame": int, "time": float, "detections": [...]}`` where
+    every detection uses the same ``class``/``confidence``/``bbox`` layout as
+    ``detect_vehicles`` in app.py. Lookups are by timestamp so the overlay
+    stays correct after seeking or dropping frames.
+    """
+    
+    def __init__(self, records):
+        records = sorted(records, key=lambda r: r['time'])
+        self.times = [r['time'] for r in records]
+        self.records = records
+    
+    @classmethod
+    def load(cls, path):
+        records = []
+        with open(path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if 'time' in record and 'detections' in record:
+                    records.append(record)
+        return cls(records)
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def lookup(self, timestamp, tolerance):
+        """Return detections for the record at or just before ``timestamp``"""
+        index = bisect.bisect_right(self.times, timestamp + 1e-6) - 1
+        if index < 0:
+            return []
+        if timestamp - self.times[index] > tolerance:
+            return []
+        return self.records[index]['detections']
+
+class PrefetchReader:
+    """Decode frames on a background thread into a small ring buffer.
+    
+    Items are ``(generation, frame_index, timestamp, frame)`` tuples. A seek
+    bumps the generation so the consumer can discard frames decoded before
+    the seek took effect. ``None`` as the frame marks end of stream.
+    """
+    
+    def __init__(self, cap, fps, buffer_size=8):
+        self.cap = cap
+        self.fps = fps
+        self.frames = queue.Queue(maxsize=buffer_size)
+        self.generation = 0
+        self._seek_to = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def seek(self, timestamp):
+        """Request a seek to ``timestamp`` seconds; returns the new generation"""
+        with self._lock:
+            self.generation += 1
+            self._seek_to = max(0.0, timestamp)
+            generation = self.generation
+        # Unblock the decoder if it is waiting on a full buffer
+        self._drain()
+        return generation
+    
+    def get(self, timeout=None):
+        return self.frames.get(timeout=timeout)
+    
+    def stop(self):
+        self._stopped.set()
+        self._drain()
+        self._thread.join(timeout=1.0)
+    
+    def _drain(self):
+        try:
+            while True:
+                self.frames.get_nowait()
+        except queue.Empty:
+            pass
+    
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if item[0] != self.generation:
+                    return
+    
+    def _run(self):
+        ended = False
+        while not self._stopped.is_set():
+            with self._lock:
+                seek_to = self._seek_to
+                self._seek_to = None
+                generation = self.generation
+            if seek_to is not None:
+                self.cap.set(cv2.CAP_PROP_POS_MSEC, seek_to * 1000.0)
+                ended = False
+            if ended:
+                time.sleep(0.01)
+                continue
+            
+            frame_index = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            ret, frame = self.cap.read()
+            if not ret:
+                ended = True
+                self._put((generation, frame_index, frame_index / self.fps, None))
+                continue
+            self._put((generation, frame_index, frame_index / self.fps, frame))
 
-def play_video(video_path):
+class PlaybackClock:
+    """Map media timestamps onto the wall clock"""
+    
+    def __init__(self):
+        self.anchor(0.0)
+    
+    def anchor(self, media_time):
+        self._media_start = media_time
+        self._wall_start = time.perf_counter()
+    
+    def due_in(self, media_time):
+        """Seconds until ``media_time`` should be on screen (negative if late)"""
+        return (self._wall_start + (media_time - self._media_start)) - time.perf_counter()
+
+def draw_overlay(frame, detections):
+    """Draw detections (a DetectionBatch, or sidecar dicts) onto a frame"""
+    if isinstance(detections, DetectionBatch):
+        rows = detections.rows()
+    else:
+        rows = ((d['class'], d['confidence'], d['bbox']) for d in detections)
+    for class_name, confidence, (x1, y1, x2, y2) in rows:
+        color = OVERLAY_COLORS.get(class_name, (0, 255, 0))
+        
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        label = f"{class_name}: {confidence:.2f}"
+        label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+        cv2.rectangle(frame, (x1, y1 - label_size[1] - 10), (x1 + label_size[0], y1), color, -1)
+        cv2.putText(frame, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+    
+    return frame
+
+def play_video(video_path, sidecar_path=None, start_time=0.0, buffer_size=8):
     """Play a video file using OpenCV"""
     
     if not os.path.exists(video_path):
@@ -21,63 +200,135 @@ def play_video(video_path):
         return
     
     # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     duration = total_frames / fps
+    frame_interval = 1.0 / fps
+    
+    # Load detection overlay, if any
+    if sidecar_path is None:
+        sidecar_path = sidecar_path_for(video_path)
+        if not os.path.exists(sidecar_path):
+            sidecar_path = None
+    sidecar = None
+    if sidecar_path:
+        try:
+            sidecar = DetectionSidecar.load(sidecar_path)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not load sidecar '{sidecar_path}': {e}")
     
     print(f"Playing: {video_path}")
     print(f"Resolution: {width}x{height}")
     print(f"FPS: {fps:.1f}")
     print(f"Duration: {duration:.1f} seconds")
     print(f"Total frames: {total_frames}")
+    if sidecar is not None:
+        print(f"Overlay: {sidecar_path} ({len(sidecar)} frames with detections)")
     print("\nControls:")
     print("  - Press 'q' to quit")
     print("  - Press 'p' to pause/resume")
     print("  - Press 'r' to restart")
+    print("  - Press 'j'/'l' to seek back/forward 5 seconds")
+    print("  - Press 'o' to toggle the detection overlay")
     print("  - Press 's' to save current frame")
     print("\nStarting playback...")
     
+    reader = PrefetchReader(cap, fps, buffer_size=buffer_size).start()
+    clock = PlaybackClock()
+    generation = reader.seek(start_time) if start_time > 0 else reader.generation
+    # The clock is anchored to the first frame decoded after a start or seek,
+    # so the time the reader spends seeking doesn't make frames late
+    anchored = False
+    
     paused = False
+    show_overlay = True
+    frame = None
     frame_count = 0
+    current_time = start_time
+    dropped_frames = 0
     
     while True:
         if not paused:
-            ret, frame = cap.read()
-            if not ret:
+            try:
+                item_generation, frame_index, timestamp, next_frame = reader.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if item_generation != generation:
+                continue
+            if next_frame is None:
                 print("End of video reached")
                 break
+            if not anchored:
+                clock.anchor(timestamp)
+                anchored = True
             
-            frame_count += 1
+            due = clock.due_in(timestamp)
+            late = due < -frame_interval
+            if late:
+                # Too late to be worth showing; keep up with the clock. The
+                # window is still polled below so it stays responsive
+                dropped_frames += 1
+                wait_ms = 1
+            else:
+                frame = next_frame
+                frame_count = frame_index + 1
+                current_time = timestamp
+                if show_overlay and sidecar is not None:
+                    draw_overlay(frame, sidecar.lookup(timestamp, frame_interval))
+                
+                # Add frame info overlay
+                info_text = (f"Frame: {frame_count}/{total_frames} | Time: {timestamp:.1f}s"
+                             f" | Dropped: {dropped_frames}")
+                cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                wait_ms = max(1, int(due * 1000))
+        else:
+            late = False
+            wait_ms = 30
         
-        # Add frame info overlay
-        info_text = f"Frame: {frame_count}/{total_frames} | Time: {frame_count/fps:.1f}s"
-        cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        if frame is None:
+            continue
         
         # Display frame
-        cv2.imshow('Vehicle Detection Video Player', frame)
+        if not late:
+            cv2.imshow('Vehicle Detection Video Player', frame)
         
         # Handle key presses
-        key = cv2.waitKey(int(1000/fps)) & 0xFF
+        key = cv2.waitKey(wait_ms) & 0xFF
         
         if key == ord('q'):
             break
         elif key == ord('p'):
             paused = not paused
+            if not paused:
+                clock.anchor(current_time)
             print("Paused" if paused else "Resumed")
         elif key == ord('r'):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            generation = reader.seek(0.0)
+            anchored = False
+            current_time = 0.0
             frame_count = 0
             print("Restarted")
+        elif key in (ord('j'), ord('l')):
+            step = SEEK_STEP_SECONDS if key == ord('l') else -SEEK_STEP_SECONDS
+            target = min(max(0.0, current_time + step), duration)
+            generation = reader.seek(target)
+            anchored = False
+            current_time = target
+            print(f"Seek to {target:.1f}s")
+        elif key == ord('o'):
+            show_overlay = not show_overlay
+            print("Overlay on" if show_overlay else "Overlay off")
         elif key == ord('s'):
             filename = f"frame_{frame_count}.jpg"
             cv2.imwrite(filename, frame)
             print(f"Saved frame {frame_count} as {filename}")
     
+    reader.stop()
     cap.release()
     cv2.destroyAllWindows()
-    print("Video playback ended.")
+    print(f"Video playback ended. Dropped {dropped_frames} frames to stay in real time.")
 
 def list_videos():
     """List all available video files"""
@@ -95,12 +346,27 @@ def list_videos():
     print("Available video files:")
     for i, file in enumerate(video_files, 1):
         size = os.path.getsize(file) / (1024*1024)  # Size in MB
-        print(f"  {i}. {file} ({size:.1f} MB)")
+        overlay = " [overlay]" if os.path.exists(sidecar_path_for(file)) else ""
+        print(f"  {i}. {file} ({size:.1f} MB){overlay}")
     
     return video_files
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Vehicle Detection Video Player")
+    parser.add_argument('video', nargs='?', help="Video file to play (prompts if omitted)")
+    parser.add_argument('--sidecar', help=f"Detection sidecar file (default: <video>{SIDECAR_SUFFIX})")
+    parser.add_argument('--start', type=float, default=0.0, help="Start position in seconds")
+    parser.add_argument('--buffer', type=int, default=8, help="Number of frames to decode ahead")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main function"""
+    args = parse_args(argv)
+    
+    if args.video:
+        play_video(args.video, sidecar_path=args.sidecar, start_time=args.start, buffer_size=args.buffer)
+        return
+    
     print("Vehicle Detection Video Player")
     print("=" * 40)
     
@@ -121,7 +387,7 @@ def main():
         
         if 0 <= video_index < len(video_files):
             selected_video = video_files[video_index]
-            play_video(selected_video)
+            play_video(selected_video, sidecar_path=args.sidecar, start_time=args.start, buffer_size=args.buffer)
         else:
             print("Invalid choice!")
     
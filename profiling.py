@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Opt-in request profiling for the vehicle detection service
+
+A profiled request records a trace span for every pipeline stage and is
+sampled by a shared background thread that walks the request thread's stack
+at a fixed interval. When the request finishes, the profile is written to
+``PROFILE_DIR/<id>/`` as:
+
+- ``trace.json``: Chrome trace events (chrome://tracing, Perfetto, speedscope)
+- ``stacks.folded``: folded stacks for flamegraph.pl / speedscope
+
+Requests are profiled when they carry an ``X-Profile`` header matching
+``PROFILE_TOKEN`` (the header is ignored when no token is configured) or when
+they fall in the sampled share of traffic set by ``PROFILE_SAMPLE_RATE`` (or
+the ``/admin/profiling`` toggle in app.py). Unprofiled requests only pay for
+a thread-local lookup per stage.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+import metrics
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_HEADER = 'X-Profile'
+# Value X-Profile must carry to enable profiling; without one the header is ignored
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+MAX_PROFILES = int(os.environ.get('PROFILE_KEEP', '50'))
+MAX_SPANS = 20000
+PROFILE_FILES = {'trace.json': 'application/json', 'stacks.folded': 'text/plain'}
+
+settings = {
+    'sample_rate': float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    'interval_ms': float(os.environ.get('PROFILE_INTERVAL_MS', '10'))
+}
+
+_local = threading.local()
+
+class Profile:
+    """Spans and sampled stacks collected for one request"""
+    
+    def __init__(self, name):
+        self.id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:8]
+        self.name = name
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans = []
+        self.dropped_spans = 0
+        self.stacks = Counter()
+        self.samples = 0
+    
+    def add_span(self, name, start, end, args=None):
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append((name, start, end, args))
+    
+    def chrome_trace(self):
+        def us(t):
+            return round((t - self.start) * 1e6, 1)
+        
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': self.thread_id,
+                   'args': {'name': self.name}}]
+        for name, start, end, args in self.spans:
+            event = {'name': name, 'ph': 'X', 'pid': 1, 'tid': self.thread_id,
+                     'ts': us(start), 'dur': round((end - start) * 1e6, 1)}
+            if args:
+                event['args'] = args
+            events.append(event)
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'profile_id': self.id, 'request': self.name,
+                          'started_at': self.started_at, 'stack_samples': self.samples,
+                          'dropped_spans': self.dropped_spans}
+        }
+    
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+    
+    def summary(self):
+        return {'id': self.id, 'request': self.name, 'started_at': self.started_at,
+                'duration_ms': round(((self.end or time.perf_counter()) - self.start) * 1000, 2),
+                'spans': len(self.spans), 'stack_samples': self.samples}
+
+class StackSampler(threading.Thread):
+    """One background thread sampling the stacks of all profiled threads"""
+    
+    def __init__(self):
+        super().__init__(name='profile-sampler', daemon=True)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+    
+    def add(self, profile):
+        with self._lock:
+            self._active[profile.thread_id] = profile
+        self._wake.set()
+    
+    def remove(self, profile):
+        """Stop sampling profile; once this returns its stacks no longer change"""
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+    
+    def run(self):
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                # Idle until a profiled request starts
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, profile in active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stacks.append((profile, ';'.join(reversed(stack))))
+            del frames
+            
+            # Counted under the lock, and only for profiles still active, so
+            # finish() can read a profile's stacks as soon as remove() returns
+            with self._lock:
+                for profile, stack in stacks:
+                    if self._active.get(profile.thread_id) is profile:
+                        profile.stacks[stack] += 1
+                        profile.samples += 1
+            time.sleep(settings['interval_ms'] / 1000.0)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def _get_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler()
+            _sampler.start()
+        return _sampler
+
+def current():
+    """Profile attached to the calling thread, if any"""
+    return getattr(_local, 'profile', None)
+
+def should_profile(headers):
+    """Decide whether to profile a request from its headers and the sample rate"""
+    requested = headers.get(PROFILE_HEADER)
+    if requested:
+        return PROFILE_TOKEN is not None and requested == PROFILE_TOKEN
+    rate = settings['sample_rate']
+    return rate > 0 and random.random() < rate
+
+def start(name):
+    """Begin profiling the calling thread"""
+    profile = Profile(name)
+    _local.profile = profile
+    _get_sampler().add(profile)
+    return profile
+
+def finish(profile, status=None):
+    """Stop profiling and write the profile files; returns the profile id"""
+    _get_sampler().remove(profile)
+    _local.profile = None
+    profile.end = time.perf_counter()
+    profile.add_span('request', profile.start, profile.end, {'status': status} if status else None)
+    
+    path = os.path.join(PROFILE_DIR, profile.id)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'trace.json'), 'w', encoding='utf-8') as fh:
+        json.dump(profile.chrome_trace(), fh)
+    with open(os.path.join(path, 'stacks.folded'), 'w', encoding='utf-8') as fh:
+        fh.write(profile.folded())
+    with open(os.path.join(path, 'summary.json'), 'w', encoding='utf-8') as fh:
+        json.dump(profile.summary(), fh)
+    
+    _prune()
+    return profile.id
+
+def _prune():
+    """Keep only the newest MAX_PROFILES profiles on disk"""
+    try:
+        entries = sorted(os.listdir(PROFILE_DIR))
+    except OSError:
+        return
+    for entry in entries[:-MAX_PROFILES] if len(entries) > MAX_PROFILES else []:
+        shutil.rmtree(os.path.join(PROFILE_DIR, entry), ignore_errors=True)
+
+def list_profiles():
+    """Summaries of stored profiles, newest first"""
+    profiles = []
+    try:
+        entries = sorted(os.listdir(PROFILE_DIR), reverse=True)
+    except OSError:
+        return profiles
+    for entry in entries:
+        try:
+            with open(os.path.join(PROFILE_DIR, entry, 'summary.json'), 'r', encoding='utf-8') as fh:
+                profiles.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+def profile_file(profile_id, kind):
+    """Path of a stored profile file, or None if it doesn't exist"""
+    if kind not in PROFILE_FILES or os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id, kind)
+    return path if os.path.exists(path) else None
+
+@contextmanager
+def span(name, **args):
+    """Record a trace span on the active profile (no-op when not profiling)"""
+    profile = current()
+    if profile is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start_time, time.perf_counter(), args or None)
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into the stage histogram and the active trace"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        metrics.STAGE_SECONDS.observe(end_time - start_time, stage=name)
+        profile = current()
+        if profile is not None:
+            profile.add_span(name, start_time, end_time)
@@ -1,50 +1,164 @@
+import argparse
 import cv2
 import numpy as np
-from ultralytics import YOLO
+import socket
+import sys
+import threading
 import time
 from collections import defaultdict
+import tuning
+from detection_batch import DetectionBatch, dumps
+from play_video import PlaybackClock, PrefetchReader
+
+class FileSink:
+    """Write one JSON line per processed frame to a file (or '-' for stdout)"""
+    
+    def __init__(self, path):
+        self._fh = open(path, 'w', encoding='utf-8') if path != '-' else None
+    
+    def send(self, record):
+        line = dumps(record) + '\n'
+        if self._fh is None:
+            print(line, end='', flush=True)
+        else:
+            self._fh.write(line)
+            self._fh.flush()
+    
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+
+class SocketSink:
+    """Stream JSON lines to a TCP listener, reconnecting at most once a second"""
+    
+    def __init__(self, address):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.dropped = 0
+        self._sock = None
+        self._last_attempt = 0.0
+    
+    def send(self, record):
+        if self._sock is None:
+            if time.monotonic() - self._last_attempt < 1.0:
+                self.dropped += 1
+                return
+            self._last_attempt = time.monotonic()
+            try:
+                self._sock = socket.create_connection(self.address, timeout=1.0)
+            except OSError:
+                self.dropped += 1
+                return
+        try:
+            self._sock.sendall((dumps(record) + '\n').encode('utf-8'))
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            self.dropped += 1
+    
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+
+class CallbackSink:
+    """Hand each record (detections as a DetectionBatch) to a function"""
+    
+    def __init__(self, callback):
+        self.callback = callback
+    
+    def send(self, record):
+        self.callback(record)
+    
+    def close(self):
+        pass
+
+class LatestFrameGrabber:
+    """Read a live camera on a background thread, keeping only the newest frame
+    
+    A camera delivers frames in real time whether or not we keep up; reading
+    continuously stops the driver's buffer from serving stale frames.
+    """
+    
+    def __init__(self, cap):
+        self.cap = cap
+        self.grabbed = 0
+        self._frame = None
+        self._frame_time = None
+        self._sequence = 0
+        self._ended = False
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=1.0)
+    
+    @property
+    def ended(self):
+        """True once the camera has stopped delivering frames"""
+        return self._ended
+    
+    def latest(self, after_sequence, timeout=1.0):
+        """Newest (sequence, capture time, frame) after after_sequence
+        
+        Returns None at end of stream or when no new frame arrived within
+        ``timeout``; ``ended`` tells the two apart.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._sequence > after_sequence or self._ended, timeout)
+            if self._sequence <= after_sequence:
+                return None
+            return self._sequence, self._frame_time, self._frame
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            ret, frame = self.cap.read()
+            with self._cond:
+                if not ret:
+                    self._ended = True
+                    self._cond.notify_all()
+                    return
+                self._frame, self._frame_time = frame, time.perf_counter()
+                self._sequence += 1
+                self.grabbed += 1
+                self._cond.notify_all()
 
 class RealTimeVehicleDetector:
-    def __init__(self, model_path='yolov8n.pt'):
+    def __init__(self, model_path=None, config_path=None):
         """Initialize the real-time vehicle detector"""
-        self.model = YOLO(model_path)
+        # Thread count, input size and default model come from the tuned config
+        config = tuning.load_tuned_config(config_path)
+        tuning.apply_threads(config['threads'])
+        model_path = model_path or config['model']
+        if model_path == 'stub':
+            from stub_detector import StubYOLO
+            self.model = StubYOLO()
+        else:
+            from ultralytics import YOLO  # heavy; loaded only when a detector is built
+            self.model = YOLO(model_path)
+        self.predict_kwargs = tuning.predict_kwargs(config)
         self.vehicle_classes = [2, 3, 5, 7]  # car, motorcycle, bus, truck
         self.vehicle_names = ['car', 'motorcycle', 'bus', 'truck']
         self.detection_stats = defaultdict(int)
-        
+    
     def detect_vehicles(self, frame):
         """Detect vehicles in a single frame"""
-        results = self.model(frame)
-        detections = []
-        
-        for result in results:
-            boxes = result.boxes
-            if boxes is not None:
-                for box in boxes:
-                    class_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    
-                    if class_id in self.vehicle_classes and confidence > 0.5:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        vehicle_name = self.vehicle_names[self.vehicle_classes.index(class_id)]
-                        
-                        detections.append({
-                            'class': vehicle_name,
-                            'confidence': confidence,
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)]
-                        })
-                        
-                        self.detection_stats[vehicle_name] += 1
+        results = self.model(frame, **self.predict_kwargs)
+        detections = DetectionBatch.from_results(results, threshold=0.5)
+        
+        for vehicle_name, count in detections.count_by_name().items():
+            self.detection_stats[vehicle_name] += count
         
         return detections
     
     def draw_detections(self, frame, detections):
         """Draw bounding boxes and labels on the frame"""
-        for detection in detections:
-            x1, y1, x2, y2 = detection['bbox']
-            class_name = detection['class']
-            confidence = detection['confidence']
-            
+        for class_name, confidence, (x1, y1, x2, y2) in detections.rows():
             # Choose color based on vehicle type
             colors = {
                 'car': (0, 255, 0),      # Green
@@ -127,20 +241,31 @@ class RealTimeVehicleDetector:
             print(f"Error: Could not open video file {video_path}")
             return
         
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        frame_delay = int(1000 / fps)  # Delay between frames in milliseconds
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_interval = 1.0 / fps
         
         print(f"Processing video: {video_path}")
         print("Press 'q' to quit, 'r' to reset statistics, SPACE to pause/resume")
         
+        # Pace against the wall clock: the wait shrinks by however long
+        # inference took, and frames we are already late for are skipped
+        clock = PlaybackClock()
+        media_time = 0.0
         paused = False
         
         while True:
             if not paused:
-                ret, frame = cap.read()
+                ended = False
+                while clock.due_in(media_time) < -frame_interval:
+                    if not cap.grab():
+                        ended = True
+                        break
+                    media_time += frame_interval
+                ret, frame = (False, None) if ended else cap.read()
                 if not ret:
                     print("End of video reached")
                     break
+                media_time += frame_interval
                 
                 # Detect vehicles
                 detections = self.detect_vehicles(frame)
@@ -155,7 +280,8 @@ class RealTimeVehicleDetector:
             cv2.imshow('Vehicle Detection - Video File', frame)
             
             # Handle key presses
-            key = cv2.waitKey(frame_delay) & 0xFF
+            delay = 30 if paused else max(1, int(clock.due_in(media_time) * 1000))
+            key = cv2.waitKey(delay) & 0xFF
             if key == ord('q'):
                 break
             elif key == ord('r'):
@@ -163,14 +289,142 @@ class RealTimeVehicleDetector:
                 print("Statistics reset!")
             elif key == ord(' '):
                 paused = not paused
+                if not paused:
+                    clock.anchor(media_time)
                 print("Paused" if paused else "Resumed")
         
         cap.release()
         cv2.destroyAllWindows()
+    
+    def run_headless(self, source, sink, duration=None, report_interval=5.0, max_lag=None):
+        """Run detection without a window, paced against the wall clock
+        
+        ``source`` is a camera index or a video path. Video files are played
+        at their native rate: frames whose time has already passed are
+        dropped before inference instead of delaying everything after them.
+        For cameras only the newest frame is processed. Every processed frame
+        is sent to ``sink`` (FileSink, SocketSink or CallbackSink) as
+        ``{"type": "frame", ...}``; a ``{"type": "stats", ...}`` record with
+        achieved FPS and lag follows every ``report_interval`` seconds and at
+        the end. Returns the final stats.
+        """
+        live = isinstance(source, int)
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise IOError(f"Could not open {'camera' if live else 'video file'} {source}")
+        
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_interval = 1.0 / fps
+        # A file frame later than this is dropped (default: one frame)
+        max_lag = frame_interval if max_lag is None else max_lag
+        
+        stats = {'type': 'stats', 'source': str(source), 'frames': 0, 'dropped': 0,
+                 'fps': 0.0, 'lag_ms': 0.0, 'max_lag_ms': 0.0, 'elapsed': 0.0}
+        lags = []
+        start = time.perf_counter()
+        next_report = start + report_interval
+        
+        def report(final=False):
+            elapsed = time.perf_counter() - start
+            stats.update(elapsed=round(elapsed, 3), fps=round(stats['frames'] / elapsed, 2) if elapsed else 0.0,
+                         lag_ms=round(1000 * sum(lags) / len(lags), 2) if lags else 0.0,
+                         max_lag_ms=round(1000 * max(lags), 2) if lags else 0.0, final=final)
+            lags.clear()
+            sink.send(dict(stats))
+            # stderr, so it doesn't mix with records streamed to stdout
+            print(f"{stats['frames']} frames, {stats['dropped']} dropped, {stats['fps']:.1f} FPS, "
+                  f"lag {stats['lag_ms']:.0f} ms (max {stats['max_lag_ms']:.0f} ms)", file=sys.stderr)
+        
+        if live:
+            reader = LatestFrameGrabber(cap).start()
+            sequence = 0
+        else:
+            reader = PrefetchReader(cap, fps).start()
+            # Anchored on the first frame, so opening the file and filling
+            # the prefetch buffer don't count as lag
+            clock = None
+        
+        try:
+            while duration is None or time.perf_counter() - start < duration:
+                if time.perf_counter() >= next_report:
+                    report()
+                    next_report = time.perf_counter() + report_interval
+                
+                if live:
+                    item = reader.latest(sequence)
+                    if item is None:
+                        if reader.ended:
+                            break
+                        # A stalled or slow-starting camera; keep waiting
+                        continue
+                    # Frames that arrived while we were busy are skipped
+                    stats['dropped'] += item[0] - sequence - 1
+                    sequence, captured, frame = item
+                    frame_index, media_time = sequence - 1, captured - start
+                    lag = time.perf_counter() - captured
+                else:
+                    _, frame_index, media_time, frame = reader.get()
+                    if frame is None:
+                        break
+                    if clock is None:
+                        clock = PlaybackClock()
+                        clock.anchor(media_time)
+                    due = clock.due_in(media_time)
+                    if due > 0:
+                        time.sleep(due)
+                    elif -due > max_lag:
+                        stats['dropped'] += 1
+                        continue
+                    lag = max(0.0, -due)
+                
+                detections = self.detect_vehicles(frame)
+                lags.append(lag)
+                stats['frames'] += 1
+                sink.send({'type': 'frame', 'frame': frame_index, 'time': round(media_time, 3),
+                           'lag_ms': round(lag * 1000, 1), 'detections': detections})
+        finally:
+            reader.stop()
+            cap.release()
+        
+        report(final=True)
+        return stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time vehicle detection")
+    parser.add_argument('--headless', action='store_true', help="Run without a window and stream results")
+    parser.add_argument('--source', default='0', help="Camera index or video file (default: camera 0)")
+    parser.add_argument('--output', help="Write JSON lines to this file ('-' for stdout)")
+    parser.add_argument('--socket', help="Stream JSON lines to host:port over TCP")
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--report-interval', type=float, default=5.0, help="Seconds between FPS/lag reports")
+    parser.add_argument('--max-lag', type=float, help="Drop video frames later than this (seconds, default one frame)")
+    parser.add_argument('--model', help="Model file, or 'stub' for the deterministic test detector")
+    return parser.parse_args(argv)
 
-def main():
+def run_headless_cli(args):
+    """Headless mode from the command line"""
+    source = int(args.source) if args.source.isdigit() else args.source
+    if args.socket:
+        sink = SocketSink(args.socket)
+    else:
+        sink = FileSink(args.output or '-')
+    detector = RealTimeVehicleDetector(model_path=args.model)
+    try:
+        detector.run_headless(source, sink, duration=args.duration,
+                              report_interval=args.report_interval, max_lag=args.max_lag)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.close()
+
+def main(argv=None):
     """Main function to run the real-time detector"""
-    detector = RealTimeVehicleDetector()
+    args = parse_args(argv)
+    if args.headless:
+        run_headless_cli(args)
+        return
+    
+    detector = RealTimeVehicleDetector(model_path=args.model)
     
     print("Vehicle Detection System - Real Time Mode")
     print("1. Webcam detection")
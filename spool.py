@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Upload spooling for the vehicle detection service
+
+Multipart file parts larger than ``IN_MEMORY_LIMIT`` are streamed by Werkzeug
+straight into a temporary file in ``SPOOL_DIR`` as they arrive, so a large
+video never sits fully in memory. ``spool_file`` then gives an upload a
+uniquely named path that OpenCV can open: a part already spooled here is
+hard-linked, so it is written to disk only once; anything else is copied in
+fixed-size chunks.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from flask import Request
+
+SPOOL_DIR = os.environ.get('SPOOL_DIR', 'spool')
+CHUNK_SIZE = 1024 * 1024
+# Parts up to this size stay in memory (small images)
+IN_MEMORY_LIMIT = 512 * 1024
+PART_PREFIX = 'part-'
+# Spooled files older than this are left over from a crash
+STALE_SECONDS = 24 * 3600
+
+class SpoolingRequest(Request):
+    """Request whose file uploads are buffered in SPOOL_DIR instead of /tmp or RAM"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= IN_MEMORY_LIMIT:
+            return io.BytesIO()
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        # Named, so spool_file can link it; removed when the request closes it
+        return tempfile.NamedTemporaryFile('wb+', dir=SPOOL_DIR, prefix=PART_PREFIX)
+
+def spool_path(suffix=''):
+    """Unique path in the spool directory"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+def spooled_name(stream):
+    """Path of a multipart part SpoolingRequest wrote to SPOOL_DIR, or None"""
+    name = getattr(stream, 'name', None)
+    if not isinstance(name, str) or not os.path.basename(name).startswith(PART_PREFIX):
+        return None
+    if os.path.dirname(os.path.abspath(name)) != os.path.abspath(SPOOL_DIR):
+        return None
+    return name
+
+def spool_file(file, suffix='', hasher=None):
+    """Give an upload a unique spool path; returns the path
+    
+    ``file`` is a FileStorage or any binary file object. A part already
+    spooled to SPOOL_DIR is hard-linked rather than copied; anything else is
+    copied in chunks. If ``hasher`` (e.g. ``hashlib.sha256()``) is given it
+    is fed the whole content either way.
+    """
+    path = spool_path(suffix)
+    stream = getattr(file, 'stream', file)
+    name = spooled_name(stream)
+    if name is not None:
+        stream.flush()
+        try:
+            os.link(name, path)
+        except OSError:
+            pass
+        else:
+            if hasher is not None:
+                stream.seek(0)
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            return path
+    
+    stream.seek(0)
+    with open(path, 'wb') as out:
+        if hasher is None:
+            shutil.copyfileobj(stream, out, CHUNK_SIZE)
+        else:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+    return path
+
+def buffer_stream(source):
+    """Copy a binary stream into a temporary file, rewound; the caller closes it
+    
+    Up to IN_MEMORY_LIMIT stays in memory, beyond that it spills to an
+    anonymous file in SPOOL_DIR that disappears when closed.
+    """
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    buffer = tempfile.SpooledTemporaryFile(IN_MEMORY_LIMIT, 'wb+', dir=SPOOL_DIR, prefix=PART_PREFIX)
+    shutil.copyfileobj(source, buffer, CHUNK_SIZE)
+    buffer.seek(0)
+    return buffer
+
+def detach_stream(file):
+    """Take an uploaded FileStorage's stream out of the request; the caller closes it
+    
+    Flask closes ``request.files`` as soon as the view returns, before a
+    streamed response body is generated.
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+def remove_stale(max_age=STALE_SECONDS):
+    """Delete spool files left behind by interrupted requests"""
+    cutoff = time.time() - max_age
+    try:
+        entries = os.listdir(SPOOL_DIR)
+    except OSError:
+        return
+    for entry in entries:
+        path = os.path.join(SPOOL_DIR, entry)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            continue
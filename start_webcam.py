@@ -8,6 +8,7 @@ import numpy as np
 from ultralytics import YOLO
 import time
 from collections import defaultdict
+from detection_batch import DetectionBatch
 
 def main():
     print("Starting Vehicle Detection - Webcam Mode")
@@ -17,9 +18,7 @@ def main():
     print("Loading YOLO model...")
     model = YOLO('yolov8n.pt')
     
-    # Vehicle classes
-    vehicle_classes = [2, 3, 5, 7]  # car, motorcycle, bus, truck
-    vehicle_names = ['car', 'motorcycle', 'bus', 'truck']
+    # Vehicle classes (car, motorcycle, bus, truck) are filtered by DetectionBatch
     detection_stats = defaultdict(int)
     
     # Initialize camera
@@ -40,33 +39,13 @@ def main():
         
         # Detect vehicles
         results = model(frame)
-        detections = []
+        detections = DetectionBatch.from_results(results, threshold=0.5)
         
-        for result in results:
-            boxes = result.boxes
-            if boxes is not None:
-                for box in boxes:
-                    class_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    
-                    if class_id in vehicle_classes and confidence > 0.5:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        vehicle_name = vehicle_names[vehicle_classes.index(class_id)]
-                        
-                        detections.append({
-                            'class': vehicle_name,
-                            'confidence': confidence,
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)]
-                        })
-                        
-                        detection_stats[vehicle_name] += 1
+        for vehicle_name, count in detections.count_by_name().items():
+            detection_stats[vehicle_name] += count
         
         # Draw detections
-        for detection in detections:
-            x1, y1, x2, y2 = detection['bbox']
-            class_name = detection['class']
-            confidence = detection['confidence']
-            
+        for class_name, confidence, (x1, y1, x2, y2) in detections.rows():
             # Choose color based on vehicle type
             colors = {
                 'car': (0, 255, 0),      # Green
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Stand-in for ultralytics.YOLO that returns deterministic detections
+
+Used by the benchmarks and load tests so results don't depend on a model
+file. Results mimic the parts of the ultralytics API the app relies on:
+``result.boxes`` (iterable, with ``cls``/``conf``/``xyxy``), ``box.xyxy[0].cpu().numpy()``
+and ``result.speed``.
+"""
+
+import time
+
+import numpy as np
+
+# COCO ids cycled through by the stub: car, motorcycle, bus, truck, person
+STUB_CLASS_IDS = [2, 3, 5, 7, 0]
+
+class StubTensor(np.ndarray):
+    """ndarray with the torch-style accessors used on YOLO boxes"""
+    
+    def cpu(self):
+        return self
+    
+    def numpy(self):
+        return self.view(np.ndarray)
+
+def _tensor(values, dtype=np.float32):
+    return np.asarray(values, dtype=dtype).view(StubTensor)
+
+class StubBoxes:
+    """Minimal ultralytics Boxes: iterating yields one-row Boxes"""
+    
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = _tensor(xyxy).reshape(-1, 4)
+        self.conf = _tensor(conf)
+        self.cls = _tensor(cls)
+    
+    def __len__(self):
+        return len(self.cls)
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield StubBoxes(self.xyxy[i:i + 1], self.conf[i:i + 1], self.cls[i:i + 1])
+
+class StubResult:
+    def __init__(self, boxes, orig_shape, speed):
+        self.boxes = boxes
+        self.orig_shape = orig_shape
+        self.speed = speed
+
+class StubYOLO:
+    """Deterministic detector with an optional simulated inference cost.
+    
+    Each image gets ``boxes_per_image`` boxes laid out on a grid scaled to the
+    image size, with classes cycling through ``STUB_CLASS_IDS`` so the vehicle
+    filter in ``detect_vehicles`` has something to discard.
+    """
+    
+    def __init__(self, model_path=None, boxes_per_image=4, latency_ms=0.0):
+        self.model_path = model_path
+        self.boxes_per_image = boxes_per_image
+        self.latency_ms = latency_ms
+    
+    def _boxes_for(self, shape):
+        height, width = shape[:2]
+        n = self.boxes_per_image
+        cols = max(1, int(np.ceil(np.sqrt(n))))
+        rows = max(1, int(np.ceil(n / cols)))
+        cell_w, cell_h = width / cols, height / rows
+        
+        idx = np.arange(n)
+        x1 = (idx % cols) * cell_w + cell_w * 0.1
+        y1 = (idx // cols) * cell_h + cell_h * 0.1
+        xyxy = np.stack([x1, y1, x1 + cell_w * 0.8, y1 + cell_h * 0.8], axis=1)
+        conf = 0.95 - (idx % 10) * 0.05
+        cls = np.array([STUB_CLASS_IDS[i % len(STUB_CLASS_IDS)] for i in idx])
+        return StubBoxes(xyxy, conf, cls)
+    
+    def __call__(self, source, **kwargs):
+        images = source if isinstance(source, (list, tuple)) else [source]
+        
+        start = time.perf_counter()
+        if self.latency_ms:
+            # One simulated forward pass per call, like a batched model
+            time.sleep(self.latency_ms / 1000.0)
+        inference_ms = (time.perf_counter() - start) * 1000.0 / len(images)
+        
+        speed = {'preprocess': 0.0, 'inference': inference_ms, 'postprocess': 0.0}
+        return [StubResult(self._boxes_for(image.shape), image.shape[:2], dict(speed))
+                for image in images]
+    
+    predict = __call__
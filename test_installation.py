@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
 """
 Test script to verify the vehicle detection system installation
+
+With --tune it also probes the host (cores, SIMD support, memory) and runs
+short calibration inferences over candidate thread counts, batch sizes, input
+sizes and backends, then writes the fastest configuration to
+tuned_config.json for app.py and RealTimeVehicleDetector to use.
 """
 
 import sys
+import argparse
 import importlib
+import itertools
+import os
+import platform
 import subprocess
+import time
+
+# Input sizes tried by --tune; smaller ones are faster but less accurate
+CANDIDATE_IMGSZ = (320, 480, 640)
 
 def test_imports():
     """Test if all required packages can be imported"""
@@ -38,13 +51,13 @@ def test_imports():
     
     return failed_imports
 
-def test_yolo_model():
+def test_yolo_model(model_path='yolov8n.pt'):
     """Test if YOLO model can be loaded"""
     print("\nTesting YOLO model loading...")
     
     try:
         from ultralytics import YOLO
-        model = YOLO('yolov8n.pt')
+        model = YOLO(model_path)
         print("[OK] YOLO model loaded successfully")
         return True
     except Exception as e:
@@ -95,8 +108,199 @@ def test_flask():
         print(f"[FAIL] Flask test failed: {e}")
         return False
 
-def main():
+def read_cpu_flags():
+    """SIMD-related CPU flags from /proc/cpuinfo (Linux) or torch"""
+    flags = set()
+    try:
+        with open('/proc/cpuinfo', 'r') as fh:
+            for line in fh:
+                if line.startswith(('flags', 'Features')):
+                    flags.update(line.split(':', 1)[1].split())
+                    break
+    except OSError:
+        pass
+    
+    simd = sorted(flags & {'sse4_1', 'sse4_2', 'avx', 'avx2', 'fma', 'f16c', 'avx512f',
+                           'avx512bw', 'avx512_vnni', 'avx_vnni', 'amx_tile', 'neon', 'asimd',
+                           'asimddp', 'sve'})
+    try:
+        import torch
+        capability = torch.backends.cpu.get_cpu_capability()
+        if capability:
+            simd.append(f"torch:{capability}")
+    except (ImportError, AttributeError):
+        pass
+    return simd
+
+def probe_hardware():
+    """Describe the host: cores, SIMD support, memory and accelerators"""
+    logical = os.cpu_count() or 1
+    physical = None
+    memory_gb = None
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+        memory_gb = psutil.virtual_memory().total / (1024 ** 3)
+    except ImportError:
+        try:
+            memory_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 ** 3)
+        except (ValueError, OSError, AttributeError):
+            pass
+    
+    # Cores actually available to this process (containers, taskset)
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = logical
+    
+    cuda = False
+    try:
+        import torch
+        cuda = torch.cuda.is_available()
+    except ImportError:
+        pass
+    
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'logical_cores': logical,
+        'physical_cores': physical,
+        'available_cores': available,
+        'simd': read_cpu_flags(),
+        'memory_gb': round(memory_gb, 1) if memory_gb else None,
+        'cuda': cuda
+    }
+
+def candidate_threads(cores):
+    """1, 2, 4, ... up to the available cores, plus the core count itself"""
+    counts = []
+    n = 1
+    while n < cores:
+        counts.append(n)
+        n *= 2
+    counts.append(cores)
+    return counts
+
+def candidate_backends(model_path):
+    """The model file plus any exported variants sitting next to it"""
+    stem = os.path.splitext(model_path)[0]
+    backends = [model_path]
+    for exported in (stem + '.onnx', stem + '_openvino_model', stem + '.torchscript'):
+        if os.path.exists(exported):
+            backends.append(exported)
+    return backends
+
+def time_inference(model, frame, batch_size, imgsz, iterations):
+    """Images per second and per-call latency for one configuration"""
+    batch = [frame] * batch_size
+    for _ in range(2):
+        model(batch, imgsz=imgsz, verbose=False)  # warmup
+    
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        model(batch, imgsz=imgsz, verbose=False)
+        latencies.append(time.perf_counter() - start)
+    
+    latencies.sort()
+    median = latencies[len(latencies) // 2]
+    return batch_size / median, median * 1000.0
+
+def tune(model_path='yolov8n.pt', output=None, threads=None, batch_sizes=(1, 2, 4),
+         input_sizes=None, min_imgsz=640, iterations=5):
+    """Calibrate inference settings on this machine and write the best one
+    
+    Only input sizes of at least ``min_imgsz`` are measured, since smaller
+    ones could not be selected; ``input_sizes`` defaults to those of
+    CANDIDATE_IMGSZ.
+    """
+    import tuning
+    from create_test_video import render_frame
+    from ultralytics import YOLO
+    
+    if input_sizes is None:
+        input_sizes = CANDIDATE_IMGSZ
+    skipped = [size for size in input_sizes if size < min_imgsz]
+    input_sizes = [size for size in input_sizes if size >= min_imgsz]
+    if skipped:
+        print(f"[WARN] Skipping input sizes below --min-imgsz {min_imgsz}: {', '.join(map(str, skipped))}")
+    if not input_sizes:
+        print("[FAIL] No input size to calibrate")
+        return None
+    
+    print("\nProbing hardware...")
+    hardware = probe_hardware()
+    for key, value in hardware.items():
+        print(f"  {key}: {value}")
+    
+    threads = threads or candidate_threads(hardware['available_cores'])
+    frame = render_frame(0, 1280, 720, density=4)
+    measurements = []
+    
+    print("\nCalibrating (images/s, median latency per call)...")
+    for backend in candidate_backends(model_path):
+        try:
+            model = YOLO(backend)
+        except Exception as e:
+            print(f"[WARN] Skipping backend {backend}: {e}")
+            continue
+        
+        for thread_count, batch_size, imgsz in itertools.product(threads, batch_sizes, input_sizes):
+            tuning.apply_threads(thread_count)
+            try:
+                images_per_second, latency_ms = time_inference(model, frame, batch_size, imgsz, iterations)
+            except Exception as e:
+                print(f"[WARN] {backend} threads={thread_count} batch={batch_size} imgsz={imgsz}: {e}")
+                continue
+            measurements.append({'model': backend, 'threads': thread_count, 'batch_size': batch_size,
+                                 'imgsz': imgsz, 'images_per_second': round(images_per_second, 2),
+                                 'latency_ms': round(latency_ms, 2)})
+            print(f"  {backend} threads={thread_count} batch={batch_size} imgsz={imgsz}: "
+                  f"{images_per_second:.1f} img/s, {latency_ms:.1f} ms")
+    
+    if not measurements:
+        print("[FAIL] No configuration could be measured")
+        return None
+    
+    best = max(measurements, key=lambda m: m['images_per_second'])
+    config = {
+        'model': best['model'],
+        'threads': best['threads'],
+        'batch_size': best['batch_size'],
+        'imgsz': best['imgsz'],
+        'images_per_second': best['images_per_second'],
+        'latency_ms': best['latency_ms'],
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': hardware,
+        'measurements': measurements
+    }
+    path = tuning.save_tuned_config(config, output)
+    
+    print(f"\n[OK] Best: {best['model']} threads={best['threads']} batch={best['batch_size']} "
+          f"imgsz={best['imgsz']} ({best['images_per_second']:.1f} img/s)")
+    print(f"[OK] Tuned configuration written to {path}")
+    return config
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the installation and optionally tune inference")
+    parser.add_argument('--tune', action='store_true', help="Probe the host and calibrate inference settings")
+    parser.add_argument('--model', default='yolov8n.pt', help="Model file to calibrate")
+    parser.add_argument('--output', help="Where to write the tuned configuration (default: tuned_config.json)")
+    parser.add_argument('--threads', help="Comma-separated thread counts to try (default: powers of two up to the cores)")
+    parser.add_argument('--batch-sizes', default='1,2,4', help="Comma-separated batch sizes to try")
+    parser.add_argument('--imgsz', help="Comma-separated input sizes to try "
+                        "(default: 320,480,640 down to --min-imgsz)")
+    parser.add_argument('--min-imgsz', type=int, default=640,
+                        help="Smallest input size to try; smaller is faster but less accurate "
+                             "(default keeps full accuracy)")
+    parser.add_argument('--iterations', type=int, default=5, help="Timed calls per configuration")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Run all tests"""
+    args = parse_args(argv)
+    
     print("Vehicle Detection System - Installation Test")
     print("=" * 50)
     
@@ -104,7 +308,7 @@ def main():
     failed_imports = test_imports()
     
     # Test YOLO model
-    yolo_ok = test_yolo_model()
+    yolo_ok = test_yolo_model(args.model)
     
     # Test OpenCV
     opencv_ok = test_opencv()
@@ -144,6 +348,19 @@ def main():
     # Overall status
     all_ok = not failed_imports and yolo_ok and opencv_ok and flask_ok
     
+    if all_ok and args.tune:
+        def as_ints(value):
+            return [int(v) for v in value.split(',') if v.strip()]
+        
+        config = tune(args.model, args.output,
+                      threads=as_ints(args.threads) if args.threads else None,
+                      batch_sizes=as_ints(args.batch_sizes),
+                      input_sizes=as_ints(args.imgsz) if args.imgsz else None,
+                      min_imgsz=args.min_imgsz,
+                      iterations=args.iterations)
+        if config is None:
+            return 1
+    
     if all_ok:
         print("\n[SUCCESS] All tests passed! The system is ready to use.")
         print("\nTo start the web dashboard:")
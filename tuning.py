@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Per-machine inference settings written by ``python test_installation.py --tune``
+
+app.py and RealTimeVehicleDetector read the tuned configuration at startup so
+each machine type runs with its measured best thread count, batch size, input
+size and backend. Missing or unreadable files fall back to the defaults.
+"""
+
+import json
+import os
+
+import cv2
+
+TUNED_CONFIG_PATH = os.environ.get('TUNED_CONFIG', 'tuned_config.json')
+
+DEFAULT_CONFIG = {
+    'model': 'yolov8n.pt',
+    'threads': None,     # None leaves torch/OpenCV at their own defaults
+    'batch_size': 1,
+    'imgsz': None        # None uses the model's training size
+}
+
+def load_tuned_config(path=None):
+    """Return the tuned settings merged over the defaults"""
+    config = dict(DEFAULT_CONFIG)
+    path = path or TUNED_CONFIG_PATH
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            tuned = json.load(fh)
+    except FileNotFoundError:
+        return config
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring tuned config '{path}': {e}")
+        return config
+    config.update({key: tuned[key] for key in DEFAULT_CONFIG if key in tuned})
+    return config
+
+def save_tuned_config(config, path=None):
+    path = path or TUNED_CONFIG_PATH
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(config, fh, indent=2)
+    return path
+
+def apply_threads(threads):
+    """Set the intra-op thread budget for torch and OpenCV"""
+    if not threads:
+        return
+    cv2.setNumThreads(int(threads))
+    try:
+        import torch
+        torch.set_num_threads(int(threads))
+    except ImportError:
+        pass
+
+def predict_kwargs(config):
+    """Keyword arguments to pass on every model call"""
+    kwargs = {}
+    if config.get('imgsz'):
+        kwargs['imgsz'] = int(config['imgsz'])
+    return kwargs